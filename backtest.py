@@ -1,4 +1,6 @@
-from features import volume_weight_avg_price, bid_ask_spread, total_qty
+import numpy as np
+import pandas as pd
+from features import volume_weight_avg_price, bid_ask_spread, total_qty, snapshots_to_arrays
 series = [
     { "bids": [[3023.00 , 4.0]], "asks": [[860000.00 , 5.0]]},
     { "bids": [[9003.00 , 1.5]], "asks": [[600000.00 , 1.0]]},
@@ -34,26 +36,62 @@ def snapshot_to_order(snapshot):
     else:
         decision = "NEUTRAL"
     return decision, total_buying, total_selling
-def backtest(series):
-    """Backtest the trading strategy on a series of snapshots."""
-    final_total_buying = 0
-    final_total_selling = 0
-    for i, snapshot in enumerate(series, start = 1):
-        decision, total_buying, total_selling = snapshot_to_order(snapshot)
-        final_total_buying += total_buying
-        final_total_selling += total_selling 
-        print(f"Snapshot {i}: {decision} | Total Buying: {total_buying} | Total Selling: {total_selling}")
+def decide(total_buying, total_selling, threshold=0.0):
+    """Vectorized snapshot_to_order decision for arrays of buying/selling totals.
+    threshold is the share of the total volume one side has to lead by (0 = any lead,
+    which is exactly snapshot_to_order's rule)."""
+    margin = threshold * (total_buying + total_selling)
+    return np.select(
+        [(total_buying - total_selling > margin) & (total_buying > 0), (total_selling - total_buying > margin) & (total_selling > 0)],
+        ["GO LONG", "GO SHORT"],
+        default="NEUTRAL",
+    )
+
+def backtest_vectorized(series, threshold=0.0):
+    """Runs the strategy over the whole series at once with NumPy instead of snapshot by snapshot.
+    Returns a DataFrame with one row per snapshot: decision, total_buying, total_selling and the
+    running cum_buying / cum_selling pressure. The overall decision is in result.attrs["decision"]."""
+    bids, asks = snapshots_to_arrays(series)
+    return backtest_arrays(bids, asks, threshold)
+
+def backtest_arrays(bids, asks, threshold=0.0):
+    """backtest_vectorized for a series already packed by snapshots_to_arrays."""
+    bid_qty, ask_qty = bids[:, :, 1], asks[:, :, 1]
+    ## Same rule as clean_orders: only levels with a positive quantity count
+    total_buying = np.where(bid_qty > 0, bid_qty, 0.0).sum(axis=1)
+    total_selling = np.where(ask_qty > 0, ask_qty, 0.0).sum(axis=1)
+    result = pd.DataFrame({
+        "snapshot": np.arange(1, len(total_buying) + 1),
+        "decision": decide(total_buying, total_selling, threshold),
+        "total_buying": total_buying,
+        "total_selling": total_selling,
+        "cum_buying": np.cumsum(total_buying),
+        "cum_selling": np.cumsum(total_selling),
+    })
+    final_total_buying = float(total_buying.sum())
+    final_total_selling = float(total_selling.sum())
+    result.attrs["final_total_buying"] = final_total_buying
+    result.attrs["final_total_selling"] = final_total_selling
+    result.attrs["decision"] = str(decide(np.array(final_total_buying), np.array(final_total_selling), threshold))
+    return result
+
+def backtest(series, verbose=True):
+    """Backtest the trading strategy on a series of snapshots.
+    Prints the summary (and every snapshot when verbose) and returns the backtest_vectorized result."""
+    result = backtest_vectorized(series)
+    final_total_buying = result.attrs["final_total_buying"]
+    final_total_selling = result.attrs["final_total_selling"]
+    if verbose:
+        for i, decision, total_buying, total_selling in zip(result["snapshot"].tolist(), result["decision"].tolist(),
+                                                            result["total_buying"].tolist(), result["total_selling"].tolist()):
+            print(f"Snapshot {i}: {decision} | Total Buying: {total_buying} | Total Selling: {total_selling}")
     print(f"Final Total Buying: {final_total_buying} | Final Total Selling: {final_total_selling}")     
 
     print("\n===Summary===")
     print(f"Final Total Buying Pressure: {final_total_buying }")
     print(f"Final Total Suying Pressure: {final_total_selling }") 
-    if final_total_buying > final_total_selling:
-        print("Overall Decision: GO LONG")
-    elif final_total_selling > final_total_buying:
-        print("Overall Decision: GO SHORT" )
-    else:
-        print("Overall Decision: NEUTRAL")
+    print(f"Overall Decision: {result.attrs['decision']}")
+    return result
         
 if __name__ == "__main__": 
     backtest(series)
\ No newline at end of file
@@ -0,0 +1,183 @@
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+from model import OrderBookModel, Orderbook, Order
+
+"""Microbenchmarks for the matching engines in model.py.
+A synthetic order flow is generated once and replayed through every book implementation:
+    - the mid price follows a random walk whose volatility depends on the regime
+      (calm, volatile, or mixed which switches between the two)
+    - new orders rest up to `depth` ticks away from the mid, a share of them cross the spread
+    - cancels of earlier orders make up `cancel_ratio` cancels per added order
+For every operation type it reports p50 / p99 / p99.9 latency, throughput and the peak
+memory of the run, and writes it all as JSON so runs can be compared:
+    python bench.py --orders 200000 --output new.json --compare old.json"""
+
+REGIMES = {"calm": 0.2, "volatile": 2.0} ## random walk step size in ticks per operation
+
+def generate_flow(orders=100_000, depth=50, cancel_ratio=0.7, regime="mixed", aggressive=0.1, seed=42):
+    """Builds the list of operations: ("add", order_id, side, price, quantity) or ("cancel", order_id)."""
+    rng = random.Random(seed)
+    mid = 10_000.0 ## in ticks
+    sigma = REGIMES["calm"] if regime == "mixed" else REGIMES[regime]
+    live = [] ## ids that may still be resting
+    ops = []
+    next_id = 1
+    cancel_share = cancel_ratio / (1 + cancel_ratio) ## so that cancels / adds comes out at cancel_ratio
+    while len(ops) < orders:
+        if regime == "mixed" and rng.random() < 0.001: ## switch regime now and then
+            sigma = REGIMES["volatile"] if sigma == REGIMES["calm"] else REGIMES["calm"]
+        mid += rng.gauss(0, sigma)
+        if live and rng.random() < cancel_share:
+            index = rng.randrange(len(live))
+            live[index], live[-1] = live[-1], live[index]
+            ops.append(("cancel", live.pop()))
+            continue
+        side = "buy" if rng.random() < 0.5 else "sell"
+        offset = rng.randint(1, depth)
+        if rng.random() < aggressive: ## crosses the spread and trades
+            offset = -offset
+        ticks = round(mid - offset) if side == "buy" else round(mid + offset)
+        ops.append(("add", next_id, side, ticks / 100, rng.randint(1, 100)))
+        live.append(next_id)
+        next_id += 1
+    return ops
+
+## Each book gets an adapter with the same add / cancel / match calls. match is None for
+## books that already match inside add
+def _model_book():
+    book = OrderBookModel()
+    def add(order_id, side, price, quantity):
+        book.add_order(side, price, quantity, order_id)
+    return book, add, book.cancel_order, None
+
+def _heap_book():
+    book = Orderbook()
+    def add(order_id, side, price, quantity):
+        book.add_order(Order(price, quantity, side, order_id))
+    return book, add, book.cancel_order, book.match_orders
+
+BOOKS = {"OrderBookModel": _model_book, "Orderbook": _heap_book}
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_book(make_book, ops):
+    """Times every operation of the flow on a fresh book, then replays it again under
+    tracemalloc for the peak memory (tracing would distort the latencies). When the book
+    matches in a separate call, it runs after every add and is timed as its own "match"."""
+    _, add, cancel, match = make_book()
+    latencies = {"add": [], "cancel": []}
+    if match:
+        latencies["match"] = []
+    clock = time.perf_counter_ns
+    gc.collect()
+    gc.disable() ## keep collector pauses out of single-operation timings
+    try:
+        start = clock()
+        for op in ops:
+            if op[0] == "add":
+                t0 = clock()
+                add(op[1], op[2], op[3], op[4])
+                latencies["add"].append(clock() - t0)
+                if match:
+                    t0 = clock()
+                    match()
+                    latencies["match"].append(clock() - t0)
+            else:
+                t0 = clock()
+                cancel(op[1])
+                latencies["cancel"].append(clock() - t0)
+        total_ns = clock() - start
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    book, add, cancel, match = make_book()
+    for op in ops:
+        if op[0] == "add":
+            add(op[1], op[2], op[3], op[4])
+            if match:
+                match()
+        else:
+            cancel(op[1])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {"operations": {}, "total_seconds": total_ns / 1e9,
+              "throughput_ops_per_s": len(ops) / (total_ns / 1e9), "peak_memory_bytes": peak}
+    for name, values in latencies.items():
+        values.sort()
+        result["operations"][name] = {
+            "count": len(values),
+            "p50_ns": percentile(values, 50),
+            "p99_ns": percentile(values, 99),
+            "p99.9_ns": percentile(values, 99.9),
+            "max_ns": values[-1] if values else None,
+        }
+    return result
+
+def compare(current, baseline, tolerance):
+    """Prints p99 and throughput changes against an earlier run; returns True if anything
+    got worse by more than tolerance (0.1 = 10%)."""
+    regressed = False
+    for book, result in current["books"].items():
+        old = baseline.get("books", {}).get(book)
+        if old is None:
+            continue
+        ratio = result["throughput_ops_per_s"] / old["throughput_ops_per_s"]
+        print(f"{book}: throughput x{ratio:.2f}")
+        regressed |= ratio < 1 - tolerance
+        for name, stats in result["operations"].items():
+            old_stats = old["operations"].get(name)
+            if not old_stats or not old_stats["p99_ns"] or not stats["p99_ns"]:
+                continue
+            ratio = stats["p99_ns"] / old_stats["p99_ns"]
+            print(f"  {name} p99 x{ratio:.2f}")
+            regressed |= ratio > 1 + tolerance
+    return regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Order book matching-engine microbenchmarks")
+    parser.add_argument("--orders", type=int, default=100_000, help="operations in the flow")
+    parser.add_argument("--depth", type=int, default=50, help="how many ticks from the mid orders rest")
+    parser.add_argument("--cancel-ratio", type=float, default=0.7)
+    parser.add_argument("--regime", choices=["calm", "volatile", "mixed"], default="mixed")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--books", nargs="+", choices=list(BOOKS), default=list(BOOKS))
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    ops = generate_flow(args.orders, args.depth, args.cancel_ratio, args.regime, seed=args.seed)
+    results = {
+        "config": {"orders": args.orders, "depth": args.depth, "cancel_ratio": args.cancel_ratio,
+                   "regime": args.regime, "seed": args.seed},
+        "python": platform.python_version(),
+        "books": {name: run_book(BOOKS[name], ops) for name in args.books},
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            print("Regression detected")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
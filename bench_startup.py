@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+"""Cold-start benchmark for the moderation pipeline.
+Starts fresh Python processes that import preprocess, load a saved model and moderate one
+message, the way a new autoscaled worker would, and reports how long each step took:
+    python bench_startup.py moderation_model.joblib --runs 10 --max-ms 3000
+Exits with 1 when the median time to the first verdict is over --max-ms."""
+
+CHILD = """
+import sys, json, time
+start = time.perf_counter()
+import preprocess
+imported = time.perf_counter()
+preprocessor = preprocess.BannedSpeechPreprocessor.load_model(sys.argv[1], mmap=sys.argv[2] == "1")
+loaded = time.perf_counter()
+preprocessor.predict_severity("first message of the day")
+predicted = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "load_ms": (loaded - imported) * 1000,
+                  "first_predict_ms": (predicted - loaded) * 1000, "total_ms": (predicted - start) * 1000}))
+"""
+
+def run_once(model_path, mmap=True):
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD, model_path, "1" if mmap else "0"],
+                         cwd=here, capture_output=True, text=True, check=True)
+    timings = json.loads(out.stdout.strip().splitlines()[-1])
+    timings["process_ms"] = (time.perf_counter() - start) * 1000 ## includes interpreter startup
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Moderation worker cold-start benchmark")
+    parser.add_argument("model", help="file written by BannedSpeechPreprocessor.save_model")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-mmap", action="store_true", help="load arrays into memory instead of mapping them")
+    parser.add_argument("--max-ms", type=float, help="fail when the median total_ms is above this")
+    args = parser.parse_args(argv)
+
+    model_path = os.path.abspath(args.model)
+    runs = [run_once(model_path, mmap=not args.no_mmap) for _ in range(args.runs)]
+    summary = {key: {"median": statistics.median(run[key] for run in runs), "max": max(run[key] for run in runs)}
+               for key in runs[0]}
+    print(json.dumps({"runs": args.runs, "mmap": not args.no_mmap, "timings_ms": summary}, indent=2))
+    if args.max_ms is not None and summary["total_ms"]["median"] > args.max_ms:
+        print(f"Cold start over budget: {summary['total_ms']['median']:.1f} ms > {args.max_ms} ms")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,147 @@
-import csv
-import kagglehub
-import pandas as pd
 import os
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+DATASET = "rohanrao/nifty50-stock-market-data"
+## Rows parsed per batch. Memory stays around one chunk no matter how big the file is
+CHUNK_SIZE = 100_000
+## Sides are stored as small integers in the column arrays
+BUY, SELL = 1, -1
+## Parsed CSVs are cached here as one .npy file per column
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".order_cache")
+CACHE_FORMAT = 3 ## bump when iter_order_chunks changes which rows it keeps
+ORDER_COLUMNS = {"side": np.int8, "price": np.float64, "quantity": np.int64}
+
+def download_dataset(dataset=DATASET):
+    """Downloads the Kaggle dataset (or reuses the local copy) and returns the folder it lives in.
+    Nothing is downloaded when the module is imported, only when this is called."""
+    import kagglehub
+    path = kagglehub.dataset_download(dataset)
+    print("Path to dataset files:", path)
+    return path
 
-path = kagglehub.dataset_download("rohanrao/nifty50-stock-market-data")
+def iter_order_chunks(csv_file_path, chunk_size=CHUNK_SIZE):
+    """Streams an order CSV and yields one batch of orders at a time as typed column arrays:
+        {"side": int8 (BUY / SELL), "price": float64, "quantity": int64}
+    Rows whose type is not buy or sell are dropped, and so are rows whose price or quantity
+    is missing or not above 0 (a missing price must not turn into a sell at 0.0 that crosses
+    every bid). Rows with a fractional or infinite quantity are dropped too, rather than
+    being truncated into an int64."""
+    reader = pd.read_csv(
+        csv_file_path,
+        usecols=lambda column: column in ("type", "price", "quantity"),
+        dtype={"type": "string", "price": "float64", "quantity": "float64"},
+        chunksize=chunk_size,
+    )
+    for chunk in reader:
+        if "type" not in chunk or "price" not in chunk or "quantity" not in chunk:
+            continue
+        order_type = chunk["type"].fillna("").str.lower().to_numpy(object)
+        side = np.where(order_type == "buy", BUY, np.where(order_type == "sell", SELL, 0)).astype(np.int8)
+        price = chunk["price"].to_numpy(np.float64)
+        quantity = chunk["quantity"].to_numpy(np.float64)
+        with np.errstate(invalid="ignore"):
+            ## NaN compares False, so missing values go too; only whole quantities survive the int64 cast
+            keep = ((side != 0) & (price > 0) & np.isfinite(price) & (quantity >= 1)
+                    & np.isfinite(quantity) & (quantity == np.floor(quantity)))
+        if not keep.any():
+            continue
+        yield {
+            "side": side[keep],
+            "price": price[keep],
+            "quantity": quantity[keep].astype(np.int64),
+        }
 
-print("Path to dataset files:", path)
+def feed_orders(book, chunks):
+    """Pushes streamed order batches straight into an OrderBookModel without building a list of orders.
+    Returns (orders added, trades made)."""
+    order_count = 0
+    trade_count = 0
+    for chunk in chunks:
+        for side, price, quantity in zip(chunk["side"].tolist(), chunk["price"].tolist(), chunk["quantity"].tolist()):
+            trades = book.add_order("buy" if side == BUY else "sell", price, quantity)
+            trade_count += len(trades)
+        order_count += len(chunk["side"])
+    return order_count, trade_count
+
+def cache_key(csv_file_path):
+    """Identifies one version of a CSV file by its path, size and modification time
+    (and the row filtering rules, so caches built under older rules are not reused)."""
+    info = os.stat(csv_file_path)
+    raw = f"{CACHE_FORMAT}|{os.path.abspath(csv_file_path)}|{info.st_size}|{info.st_mtime_ns}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+def _build_cache(csv_file_path, entry_dir):
+    ## Chunks are appended to raw column files first (the row count is not known up front),
+    ## then copied into .npy files, so building the cache never holds the whole file in memory
+    ## Like preprocess._parse_and_cache, a build that fails halfway removes its temporary
+    ## directory, so no partial entry is left behind
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        raw_files = {name: open(os.path.join(tmp_dir, name + ".bin"), "wb") for name in ORDER_COLUMNS}
+        rows = 0
+        try:
+            for chunk in iter_order_chunks(csv_file_path):
+                for name, dtype in ORDER_COLUMNS.items():
+                    chunk[name].astype(dtype, copy=False).tofile(raw_files[name])
+                rows += len(chunk["side"])
+        finally:
+            for f in raw_files.values():
+                f.close()
+
+        for name, dtype in ORDER_COLUMNS.items():
+            raw_path = os.path.join(tmp_dir, name + ".bin")
+            out = np.lib.format.open_memmap(os.path.join(tmp_dir, name + ".npy"), mode="w+", dtype=dtype, shape=(rows,))
+            if rows:
+                out[:] = np.memmap(raw_path, dtype=dtype, mode="r", shape=(rows,))
+            out.flush()
+            del out
+            os.remove(raw_path)
+
+        try:
+            os.replace(tmp_dir, entry_dir) ## only a finished cache entry ever gets the real name
+        except OSError: ## another process finished the same entry first
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True) ## nothing left to remove once it was renamed
+
+def load_order_columns(csv_file_path, cache_dir=CACHE_DIR):
+    """Returns the whole order file as {"side", "price", "quantity"} column arrays.
+    The first call parses the CSV and stores the columns as .npy files, later calls
+    memory-map those files read-only, so nothing is parsed or copied again until the
+    CSV changes (a new size or mtime gives a new cache entry)."""
+    entry_dir = os.path.join(cache_dir, cache_key(csv_file_path))
+    if not os.path.isdir(entry_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        _build_cache(csv_file_path, entry_dir)
+    return {name: np.load(os.path.join(entry_dir, name + ".npy"), mmap_mode="r") for name in ORDER_COLUMNS}
+
+def iter_cached_order_chunks(csv_file_path, chunk_size=CHUNK_SIZE, cache_dir=CACHE_DIR):
+    """Same batches as iter_order_chunks, but sliced out of the memory-mapped cache."""
+    columns = load_order_columns(csv_file_path, cache_dir)
+    rows = len(columns["side"])
+    for start in range(0, rows, chunk_size):
+        yield {name: column[start:start + chunk_size] for name, column in columns.items()}
+
+def clear_cache(cache_dir=CACHE_DIR):
+    """Deletes every cached column file."""
+    shutil.rmtree(cache_dir, ignore_errors=True)
 
 def load_orders_from_dataset(csv_file_path): 
+    """Loads every order in the file as a list of {"type", "price", "quantity"} dicts.
+    Fine for small files; use iter_order_chunks to stream big ones."""
     orders = []
     try:
-        with open(csv_file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            
-            for order in reader:
-                order_type = order.get('type', '').lower()
-                
-                if order_type in ['buy', 'sell']: 
-                    converted_order = {
-                        'type': order_type,
-                        'price': float(order.get('price', 0)),
-                        'quantity': int(order.get('quantity', 0))
-                    }
-                    orders.append(converted_order)
+        for chunk in iter_order_chunks(csv_file_path):
+            for side, price, quantity in zip(chunk["side"].tolist(), chunk["price"].tolist(), chunk["quantity"].tolist()):
+                orders.append({
+                    'type': 'buy' if side == BUY else 'sell',
+                    'price': price,
+                    'quantity': quantity
+                })
         return orders
     except FileNotFoundError:
         print(f"Error: The file {csv_file_path} was not found.")
@@ -30,9 +149,11 @@ def load_orders_from_dataset(csv_file_path):
     except Exception as e:
         print(f"An error occurred while loading orders: {e}")
         return []
-files = os.listdir(path)
-print("Files available:", files)
-csv_file = os.path.join(path, files[0])
-orders = load_orders_from_dataset(csv_file)
-print(orders[:5])     
-    
\ No newline at end of file
+
+if __name__ == "__main__":
+    path = download_dataset()
+    files = os.listdir(path)
+    print("Files available:", files)
+    csv_file = os.path.join(path, files[0])
+    orders = load_orders_from_dataset(csv_file)
+    print(orders[:5])
@@ -1,3 +1,9 @@
+import numpy as np
+import time
+from bisect import bisect_left, insort
+from collections import deque
+import instrument
+
 def bid_ask_spread(bids, asks):
     """
     Calculate the bid-ask spread using the highest bid and lowest ask from the first snapshot.
@@ -54,4 +60,272 @@ def orderbook_depth(bids, asks):
 def features ( bids, asks):
     """Calculate various features from the order book data."""
     results = {}
-    results['bid_ask_spread'] = bid_ask_spread(bids, asks)
\ No newline at end of file
+    results['bid_ask_spread'] = bid_ask_spread(bids, asks)
+    results['total_bid_qty'], results['total_ask_qty'] = total_qty(bids, asks)
+    results['bid_vwap'] = volume_weight_avg_price(bids)
+    results['ask_vwap'] = volume_weight_avg_price(asks)
+    results['imbalance'] = orderbook_imbalance(bids, asks)
+    results['depth'] = orderbook_depth(bids, asks)
+    return results
+
+def snapshots_to_arrays(snapshots, levels=None):
+    """Pack a series of {"bids": [[price, qty], ...], "asks": [...]} snapshots into two padded arrays
+    of shape (snapshots, levels, 2). Missing levels are padded with price NaN and qty 0,
+    and entries that are not [price, qty] pairs are skipped."""
+    def side(snapshot, key):
+        return [level for level in snapshot.get(key) or [] if level is not None and len(level) == 2]
+    bid_lists = [side(snapshot, "bids") for snapshot in snapshots]
+    ask_lists = [side(snapshot, "asks") for snapshot in snapshots]
+    if levels is None:
+        levels = max([len(orders) for orders in bid_lists + ask_lists] + [1])
+
+    def pack(lists):
+        packed = np.zeros((len(lists), levels, 2))
+        packed[:, :, 0] = np.nan
+        for i, orders in enumerate(lists):
+            orders = orders[:levels]
+            if orders:
+                packed[i, :len(orders)] = orders
+        return packed
+    return pack(bid_lists), pack(ask_lists)
+
+@instrument.timed("batch_features")
+def batch_features(bids, asks, depth_levels=5):
+    """Vectorized version of features() for a whole series of snapshots at once.
+    bids and asks are (snapshots, levels, 2) arrays as built by snapshots_to_arrays.
+    Returns a dict of 1-D arrays (one value per snapshot). A side with no orders gives
+    NaN for the spread and its VWAP, like the None the single-snapshot functions return."""
+    bid_price, bid_qty = bids[:, :, 0], np.nan_to_num(bids[:, :, 1])
+    ask_price, ask_qty = asks[:, :, 0], np.nan_to_num(asks[:, :, 1])
+    bid_present = ~np.isnan(bid_price)
+    ask_present = ~np.isnan(ask_price)
+
+    ## Every feature below reuses these sums, so each side is only summed once
+    bid_volume = bid_qty.sum(axis=1)
+    ask_volume = ask_qty.sum(axis=1)
+    total_volume = bid_volume + ask_volume
+    bid_notional = np.where(bid_present, bid_price * bid_qty, 0.0).sum(axis=1)
+    ask_notional = np.where(ask_present, ask_price * ask_qty, 0.0).sum(axis=1)
+
+    both_sides = bid_present.any(axis=1) & ask_present.any(axis=1)
+    max_bid = np.where(bid_present, bid_price, -np.inf).max(axis=1)
+    min_ask = np.where(ask_present, ask_price, np.inf).min(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "bid_ask_spread": np.where(both_sides, min_ask - max_bid, np.nan),
+            "total_bid_qty": bid_volume,
+            "total_ask_qty": ask_volume,
+            "bid_vwap": np.where(bid_volume > 0, bid_notional / bid_volume, np.nan),
+            "ask_vwap": np.where(ask_volume > 0, ask_notional / ask_volume, np.nan),
+            "imbalance": np.where(total_volume > 0, (bid_volume - ask_volume) / total_volume, 0.0),
+            "depth": bid_qty[:, :depth_levels].sum(axis=1) + ask_qty[:, :depth_levels].sum(axis=1),
+        }
+
+class FeatureTracker:
+    """Keeps the order book features up to date from book events instead of rescanning
+    the bid/ask lists. Attach it to an OrderBookModel or Orderbook (model.py) and read
+    the features after any event:
+        tracker = FeatureTracker().attach(book)
+    Every add / fill / cancel updates running totals in O(1); a price level that opens
+    or closes also updates a sorted price list (binary search), which top-N depth and
+    the best bid/ask are read from."""
+    def __init__(self, depth_levels=5):
+        self.depth_levels = depth_levels
+        self.volume = {"buy": 0, "sell": 0} ## resting quantity per side
+        self.notional = {"buy": 0.0, "sell": 0.0} ## sum of price * quantity per side, for VWAP
+        self.levels = {"buy": {}, "sell": {}} ## price -> resting quantity
+        self.prices = {"buy": [], "sell": []} ## prices with a level, ascending
+
+    def attach(self, book):
+        book.subscribe(self.on_event)
+        return self
+
+    def on_event(self, event, side, price, quantity):
+        delta = quantity if event == "add" else -quantity ## fills and cancels take quantity out
+        self.volume[side] += delta
+        if self.volume[side] == 0:
+            self.notional[side] = 0.0 ## empty side, drop any float drift
+        else:
+            self.notional[side] += delta * price
+
+        levels = self.levels[side]
+        prices = self.prices[side]
+        level_qty = levels.get(price, 0) + delta
+        if level_qty > 0:
+            if price not in levels:
+                insort(prices, price)
+            levels[price] = level_qty
+        elif price in levels:
+            del levels[price]
+            del prices[bisect_left(prices, price)]
+
+    def best_bid(self):
+        return self.prices["buy"][-1] if self.prices["buy"] else None
+
+    def best_ask(self):
+        return self.prices["sell"][0] if self.prices["sell"] else None
+
+    def bid_ask_spread(self):
+        if not self.prices["buy"] or not self.prices["sell"]:
+            return None
+        return self.prices["sell"][0] - self.prices["buy"][-1]
+
+    def total_qty(self):
+        return self.volume["buy"], self.volume["sell"]
+
+    def vwap(self, side):
+        if self.volume[side] == 0:
+            return None
+        return self.notional[side] / self.volume[side]
+
+    def imbalance(self):
+        total_volume = self.volume["buy"] + self.volume["sell"]
+        if total_volume == 0:
+            return 0
+        return (self.volume["buy"] - self.volume["sell"]) / total_volume
+
+    def depth(self):
+        """Quantity in the best depth_levels price levels of each side."""
+        n = self.depth_levels
+        top_bids = sum(self.levels["buy"][price] for price in self.prices["buy"][-n:])
+        top_asks = sum(self.levels["sell"][price] for price in self.prices["sell"][:n])
+        return top_bids + top_asks
+
+    def features(self):
+        """Same keys as features() for the current state of the book."""
+        total_bid_qty, total_ask_qty = self.total_qty()
+        return {
+            "bid_ask_spread": self.bid_ask_spread(),
+            "total_bid_qty": total_bid_qty,
+            "total_ask_qty": total_ask_qty,
+            "bid_vwap": self.vwap("buy"),
+            "ask_vwap": self.vwap("sell"),
+            "imbalance": self.imbalance(),
+            "depth": self.depth(),
+        }
+
+def _clean_levels(levels):
+    ## Same rule as backtest.clean_orders: only [price, qty] pairs with a qty above 0 count
+    return [level for level in levels or [] if isinstance(level, (list, tuple)) and len(level) == 2 and level[1] > 0]
+
+class RollingFeatures:
+    """Windowed features over the last window_events snapshots and/or the last window_seconds
+    seconds. Each update adds one snapshot's totals to running sums and the snapshots that fall
+    out of the window are subtracted again, so every update is O(1) amortized no matter how big
+    the window is. Spread min/max come from monotonic deques.
+        rolling = RollingFeatures(window_events=500)
+        rolling.update(bids, asks)
+        rolling.vwap("buy"), rolling.imbalance(), rolling.pressure()"""
+    def __init__(self, window_events=None, window_seconds=None):
+        if window_events is None and window_seconds is None:
+            raise ValueError("Give window_events, window_seconds or both")
+        self.window_events = window_events
+        self.window_seconds = window_seconds
+        ## (timestamp, bid volume, ask volume, bid notional, ask notional, spread) per snapshot in the window
+        self.window = deque()
+        self.bid_volume = 0.0
+        self.ask_volume = 0.0
+        self.bid_notional = 0.0
+        self.ask_notional = 0.0
+        self.spread_sum = 0.0
+        self.spread_count = 0
+        ## (update number, spread) pairs: increasing spreads for the min, decreasing for the max
+        self._spread_min = deque()
+        self._spread_max = deque()
+        self._count = 0 ## updates seen so far
+
+    def update(self, bids, asks, timestamp=None):
+        """Adds one snapshot ([price, qty] lists like features()) to the window. Empty or
+        malformed levels and levels with no quantity are skipped, as the backtest does."""
+        if timestamp is None:
+            timestamp = time.time()
+        bids, asks = _clean_levels(bids), _clean_levels(asks)
+        bid_volume = sum(qty for price, qty in bids)
+        ask_volume = sum(qty for price, qty in asks)
+        bid_notional = sum(float(price) * float(qty) for price, qty in bids)
+        ask_notional = sum(float(price) * float(qty) for price, qty in asks)
+        spread = bid_ask_spread(bids, asks)
+
+        self.window.append((timestamp, bid_volume, ask_volume, bid_notional, ask_notional, spread))
+        self.bid_volume += bid_volume
+        self.ask_volume += ask_volume
+        self.bid_notional += bid_notional
+        self.ask_notional += ask_notional
+        if spread is not None:
+            self.spread_sum += spread
+            self.spread_count += 1
+            while self._spread_min and self._spread_min[-1][1] >= spread:
+                self._spread_min.pop()
+            self._spread_min.append((self._count, spread))
+            while self._spread_max and self._spread_max[-1][1] <= spread:
+                self._spread_max.pop()
+            self._spread_max.append((self._count, spread))
+        self._count += 1
+        self._evict(timestamp)
+
+    def _evict(self, now):
+        while self.window and (
+            (self.window_events is not None and len(self.window) > self.window_events)
+            or (self.window_seconds is not None and now - self.window[0][0] > self.window_seconds)
+        ):
+            _, bid_volume, ask_volume, bid_notional, ask_notional, spread = self.window.popleft()
+            self.bid_volume -= bid_volume
+            self.ask_volume -= ask_volume
+            self.bid_notional -= bid_notional
+            self.ask_notional -= ask_notional
+            if spread is not None:
+                self.spread_sum -= spread
+                self.spread_count -= 1
+        ## Anything older than the oldest snapshot still in the window is gone
+        first = self._count - len(self.window)
+        while self._spread_min and self._spread_min[0][0] < first:
+            self._spread_min.popleft()
+        while self._spread_max and self._spread_max[0][0] < first:
+            self._spread_max.popleft()
+        if not self.window: ## start the sums from zero again so float drift never builds up
+            self.bid_volume = self.ask_volume = self.bid_notional = self.ask_notional = self.spread_sum = 0.0
+
+    def vwap(self, side):
+        """Volume-weighted average price of one side ("buy" or "sell") over the window."""
+        volume, notional = (self.bid_volume, self.bid_notional) if side == "buy" else (self.ask_volume, self.ask_notional)
+        if volume == 0:
+            return None
+        return notional / volume
+
+    def imbalance(self):
+        total_volume = self.bid_volume + self.ask_volume
+        if total_volume == 0:
+            return 0
+        return (self.bid_volume - self.ask_volume) / total_volume
+
+    def pressure(self):
+        """Buying minus selling volume over the window (the windowed version of the backtest totals)."""
+        return self.bid_volume - self.ask_volume
+
+    def spread_mean(self):
+        return self.spread_sum / self.spread_count if self.spread_count else None
+
+    def spread_min(self):
+        return self._spread_min[0][1] if self._spread_min else None
+
+    def spread_max(self):
+        return self._spread_max[0][1] if self._spread_max else None
+
+    def features(self):
+        return {
+            "snapshots": len(self.window),
+            "bid_vwap": self.vwap("buy"),
+            "ask_vwap": self.vwap("sell"),
+            "imbalance": self.imbalance(),
+            "pressure": self.pressure(),
+            "spread_mean": self.spread_mean(),
+            "spread_min": self.spread_min(),
+            "spread_max": self.spread_max(),
+        }
+
+## Timed by instrument.py only while instrumentation is enabled. A tracker attached to a book
+## before instrument.enable() keeps its untimed on_event (the book holds the bound method)
+instrument.hook(FeatureTracker, "on_event")
+instrument.hook(FeatureTracker, "features")
+instrument.hook(RollingFeatures, "update")
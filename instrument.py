@@ -0,0 +1,258 @@
+import io
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+"""Timing and counters for the moderation and trading hot paths, switched on at runtime:
+    import instrument
+    instrument.enable()
+    ... run traffic ...
+    print(instrument.snapshot_json())
+Stages are timed into HDR-style histograms (log-spaced buckets, so any latency from
+nanoseconds to minutes is kept to about 3% with a few hundred counters), and counters keep
+totals such as trades or cache hits. Stages can nest: add_order includes match_orders and
+the FeatureTracker updates it triggers.
+Everything is off by default. Then stage() hands back one shared do-nothing context
+manager, count() / record() / @timed return after checking a single flag, and methods
+registered with hook() are not wrapped at all, so the hooks can stay in production code.
+profile(name) wraps a run in cProfile and/or tracemalloc and adds the result to the snapshot."""
+
+ENABLED = False
+SUB_BUCKET_BITS = 6 ## 2**(6 - 1) = 32 buckets per power of two: values are kept to within 1/32 (~3%)
+
+_lock = threading.Lock()
+_stages = {} ## name -> Histogram of nanoseconds
+_values = {} ## name -> Histogram of recorded values (batch sizes, ...)
+_counters = {}
+_runs = {} ## name -> what profile() captured
+_hooks = [] ## (owner, attribute, stage name, original) for hook()
+_NULL_STAGE = nullcontext()
+
+class Histogram:
+    """Counts of non-negative integers in log-spaced buckets. Values below 2**SUB_BUCKET_BITS
+    get a bucket each; above that every power of two is split into 2**(SUB_BUCKET_BITS - 1)
+    buckets, so the relative error is the same at any scale. Min, max and mean are exact."""
+    def __init__(self):
+        self.buckets = {} ## bucket index -> count, only buckets that were hit
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def bucket(value):
+        shift = max(value.bit_length() - SUB_BUCKET_BITS, 0)
+        return (shift << SUB_BUCKET_BITS) | (value >> shift)
+
+    @staticmethod
+    def bucket_range(index):
+        ## Smallest and largest value that fall in bucket index
+        shift, top = index >> SUB_BUCKET_BITS, index & ((1 << SUB_BUCKET_BITS) - 1)
+        return top << shift, ((top + 1) << shift) - 1
+
+    def record(self, value):
+        value = int(value)
+        index = self.bucket(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        """Upper edge of the bucket holding the pct-th percentile (never above max)."""
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * pct // 100)) ## ceil, and at least the first value
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.bucket_range(index)[1], self.max)
+        return self.max
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        return self
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p99.9": self.percentile(99.9),
+        }
+
+def enable():
+    global ENABLED
+    ENABLED = True
+    for owner, attribute, name, original in _hooks:
+        setattr(owner, attribute, _timing_wrapper(name, original))
+
+def disable():
+    global ENABLED
+    ENABLED = False
+    for owner, attribute, name, original in _hooks:
+        setattr(owner, attribute, original)
+
+def reset():
+    """Drops every histogram, counter and profiled run (the on/off switch is left alone)."""
+    with _lock:
+        _stages.clear()
+        _values.clear()
+        _counters.clear()
+        _runs.clear()
+
+def count(name, amount=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def record(name, value):
+    """Adds one value (e.g. a batch size) to the histogram called name."""
+    if not ENABLED:
+        return
+    with _lock:
+        if name not in _values:
+            _values[name] = Histogram()
+        _values[name].record(value)
+
+def _record_stage(name, nanoseconds):
+    with _lock:
+        if name not in _stages:
+            _stages[name] = Histogram()
+        _stages[name].record(nanoseconds)
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record_stage(self.name, time.perf_counter_ns() - self.start)
+
+def stage(name):
+    """with stage("name"): ... times the block into the stage histogram called name."""
+    return _Stage(name) if ENABLED else _NULL_STAGE
+
+def timed(name):
+    """Decorator form of stage() for whole functions and methods."""
+    def decorate(func):
+        return _timing_wrapper(name, func)
+    return decorate
+
+def _timing_wrapper(name, func):
+    ## Checks the flag on every call, so a wrapper that outlives disable() (a bound method
+    ## handed out while enabled) goes straight to func again
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        start = time.perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record_stage(name, time.perf_counter_ns() - start)
+    return wrapper
+
+def hook(owner, attribute, name=None):
+    """Times owner.attribute (e.g. a method on a class) as the stage name, "Class.method" by
+    default. Unlike @timed nothing is wrapped while instrumentation is off: enable() swaps the
+    attribute for a timing wrapper and disable() puts the original back, which suits functions
+    called millions of times. Callbacks taken before enable() (e.g. a bound method already
+    handed to subscribe) keep calling the version they were given and are never timed. Callbacks
+    taken while enabled keep the wrapper, but it stops timing (and taking the lock) once
+    disable() is called and only costs a flag check."""
+    original = owner.__dict__[attribute]
+    name = name or f"{owner.__name__}.{attribute}"
+    _hooks.append((owner, attribute, name, original))
+    if ENABLED:
+        setattr(owner, attribute, _timing_wrapper(name, original))
+
+@contextmanager
+def profile(name, cpu=True, memory=False, top=25):
+    """Runs the with-block under cProfile (cpu) and/or tracemalloc (memory) and keeps the
+    `top` functions by cumulative time and the `top` allocation sites under snapshot()["runs"][name].
+    Works whether or not instrumentation is enabled; both profilers slow the block down."""
+    profiler = cProfile.Profile() if cpu else None
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        run = {"seconds": time.perf_counter() - start}
+        if profiler:
+            stats = pstats.Stats(profiler, stream=io.StringIO())
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+            run["cpu"] = [{
+                "function": f"{file}:{line}({function})",
+                "calls": calls,
+                "total_s": total_time,
+                "cumulative_s": cumulative_time,
+            } for (file, line, function), (_, calls, total_time, cumulative_time, _) in rows]
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            run["memory"] = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top": [{"where": str(stat.traceback), "bytes": stat.size, "blocks": stat.count}
+                        for stat in snapshot.statistics("lineno")[:top]],
+            }
+            if started_tracing:
+                tracemalloc.stop()
+        with _lock:
+            _runs[name] = run
+
+def snapshot():
+    """Everything recorded so far as plain dicts: stage latencies in nanoseconds, value
+    histograms, counters and profiled runs."""
+    with _lock:
+        return {
+            "enabled": ENABLED,
+            "taken_at": time.time(),
+            "stages_ns": {name: histogram.to_dict() for name, histogram in sorted(_stages.items())},
+            "values": {name: histogram.to_dict() for name, histogram in sorted(_values.items())},
+            "counters": dict(sorted(_counters.items())),
+            "runs": dict(_runs),
+        }
+
+def snapshot_json(path=None, indent=2):
+    """snapshot() as JSON text; also written to path when one is given."""
+    text = json.dumps(snapshot(), indent=indent)
+    if path:
+        with open(path, "w") as f:
+            f.write(text)
+    return text
@@ -1,4 +1,7 @@
+import math
 import heapq ## python heapq code(heaps ares trees where each parent is ordered before its children)
+from collections import deque
+import instrument
 """This code simulates how a basic order book works in the financial markets.
     It keeps an account of who wants to buy or sell what at what $$$ and quanttiy
     ALL done by ORDERBOOKMODEL
@@ -9,103 +12,367 @@ import heapq ## python heapq code(heaps ares trees where each parent is ordered
     more than or equal to the cheapest sale price then the code creates a trade
         - priority for those willing to pay more and those that want to sell for the lowest
         - trade happens at the avg price of the overlap price"""
+## Prices are stored as whole numbers of ticks so comparing and keying price levels
+## is exact integer work instead of float work (no 0.1 + 0.2 surprises)
+TICKS_PER_UNIT = 100 ## tick size of 0.01
+
+def to_ticks(price):
+    """Converts a price into an integer number of ticks. A price that is not on the tick grid
+    raises ValueError: rounding it would move a limit price (a sell at 100.001 could trade at 100.0)."""
+    scaled = price * TICKS_PER_UNIT
+    ticks = int(round(scaled))
+    if not math.isclose(scaled, ticks, rel_tol=1e-12, abs_tol=1e-6): ## only float noise such as 100.01 * 100 is let through
+        raise ValueError(f"Price {price} is not a multiple of the tick size {1 / TICKS_PER_UNIT}")
+    return ticks
+
+def from_ticks(ticks):
+    """Converts a number of ticks back into a price."""
+    return ticks / TICKS_PER_UNIT
+
 ## This is the blueprint for creating objects that handle order book data.
+## Orders are kept in price levels: every price maps to a FIFO queue (deque) of the orders resting
+## at that price, so orders at the same price are filled first come first served (price-time priority).
+## The prices themselves sit in a heap so the best bid / best ask is always at index 0.
+##   - adding to an existing price level is O(1), opening a new level is O(log n)
+##   - best bid / best ask is O(1)
+##   - a fill is a popleft from the front queue, O(1) (O(log n) only when the whole level empties)
+## Cancelled orders are only marked inactive. The front of every queue is always a live order,
+## and a level whose orders are all gone is dropped; its heap entry is skipped when it reaches the top.
 class OrderBookModel:
     def __init__(self):
-        ## This is a list that will hold the order book data 
-        self.buy_orders = []
-        self.sell_orders = []
+        ## price in ticks -> deque of Order objects at that price
+        self.buy_levels = {}
+        self.sell_levels = {}
+        ## Heaps of the prices that have a level. Buy prices are stored negative so the highest bid is on top
+        self._buy_prices = []
+        self._sell_prices = []
+        self.orders = {} ## order_id -> live Order, only for orders added with an id
+        self.listeners = [] ## called as listener(event, side, price, quantity)
+
+    def subscribe(self, listener):
+        """Registers a callback for book events. event is "add" (an order joined the book),
+        "fill" (part of a resting order traded) or "cancel" (quantity left the book),
+        always with the price of the order it happened to."""
+        self.listeners.append(listener)
+
+    def _emit(self, event, order, quantity):
+        price = order.price
+        for listener in self.listeners:
+            listener(event, order.side, price, quantity)
+
+    @property
+    def buy_orders(self):
+        """All resting buy orders in priority order (highest price first, then oldest first)."""
+        return [order.as_dict() for ticks in sorted(self.buy_levels, reverse=True) for order in self.buy_levels[ticks] if order.active]
+
+    @property
+    def sell_orders(self):
+        """All resting sell orders in priority order (lowest price first, then oldest first)."""
+        return [order.as_dict() for ticks in sorted(self.sell_levels) for order in self.sell_levels[ticks] if order.active]
+
+    def _top(self, prices, levels, sign):
+        ## Drops heap entries of levels that were emptied by cancels
+        while prices and sign * prices[0] not in levels:
+            heapq.heappop(prices)
+        return prices[0] if prices else None
+
+    def best_bid(self):
+        """Highest buy price in the book or None if there are no buyers."""
+        top = self._top(self._buy_prices, self.buy_levels, -1)
+        return from_ticks(-top) if top is not None else None
+
+    def best_ask(self):
+        """Lowest sell price in the book or None if there are no sellers."""
+        top = self._top(self._sell_prices, self.sell_levels, 1)
+        return from_ticks(top) if top is not None else None
 
-""" defines a method to add orders to the order book
-     Takes the order_type(string: buy,sell), price (number): price per unit for the order, and quanity(number: units to buy or sell)"""
-def add_order(self, order_type, price, quantity):
-## This is making a dictionary order to represent one order 
-    order = {"type": order_type, "price": price, "quantity": quantity}
-    
-    if order_type == "buy":
-        self.buy_orders.append(order) ## adds the new buy order dictionary to the buy_orders list
-        self.buy_orders.sort(key=lambda x: -x["price"])## sores the buying_orders list in descending order by the price where high payers get priority )
-        ## The lamda x: -x[]"price"] is to sort by negative prices 
-   
-    elif order_type == "sell":
-        self.sell_orders.append(order) #adds the new buy order dictionary to the sell_orders list
-        self.sell_orders.sort(key=lambda x: x["price"]) ## people that are willing to accept sell for less are prioritized 
-        self.match_orders() ## matches buying and sell orders 
-
-def match_orders(self):
-    trades = []
-    ## Loops both buy orders and sell orders
-    while self.buy_orders and self.sell_orders:
-        highest_buy = self.buy_orders[0] ## Checks the best buyer (highest prices) and puts it in first place in buy orders
-        highest_sell = self.sell_orders[0] ## looks at lowest sale and puts it in first in sell_orders
-        
-        if highest_buy["price"] >= highest_sell["price"]:   
-        ## if there is an ovelap between these two quantities it means that there is a trade that can be done 
-            trade_qty = min(highest_buy["quantity"], highest_sell["quantity"])    
-            trade_price_avg = (highest_buy["price"]+ highest_sell["price"])/2 ## Calculates the trade price as the avg of the buying and selling 
+    """ defines a method to add orders to the order book
+         Takes the order_type(string: buy,sell), price (number): price per unit for the order, and quanity(number: units to buy or sell)
+         order_id is optional, give one to be able to cancel the order later
+         A quantity of 0 or less raises ValueError (it would rest and make empty trades), and so
+         does a price that is not a whole number of ticks (see to_ticks)
+         Returns the list of trades the new order created"""
+    def add_order(self, order_type, price, quantity, order_id=None):
+        if order_type == "buy":
+            levels, prices, sign = self.buy_levels, self._buy_prices, -1
+        elif order_type == "sell":
+            levels, prices, sign = self.sell_levels, self._sell_prices, 1
+        else:
+            return []
+        if not quantity > 0:
+            raise ValueError(f"Order quantity must be positive, not {quantity}")
+        ## This is making a compact Order object to represent one order 
+        order = Order(price, quantity, order_type, order_id)
+        if order_id is not None:
+            if order_id in self.orders:
+                raise ValueError(f"Order id {order_id} is already in the book")
+            self.orders[order_id] = order
+        ticks = order.ticks
+
+        level = levels.get(ticks)
+        if level is None: ## first order at this price opens a new level
+            level = levels[ticks] = deque()
+            heapq.heappush(prices, sign * ticks)
+            if len(prices) > 2 * len(levels) + 64: ## too many stale prices left by cancels
+                prices[:] = [sign * level_ticks for level_ticks in levels]
+                heapq.heapify(prices)
+        level.append(order) ## joins the back of the queue at its price
+        if self.listeners:
+            self._emit("add", order, quantity)
+        if instrument.ENABLED:
+            instrument.count("book.events")
+        return self.match_orders() ## matches buying and sell orders 
+
+    def cancel_order(self, order_id):
+        """Removes a resting order by id. Returns False if the id is unknown or already filled."""
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return False
+        order.active = False
+        if self.listeners:
+            self._emit("cancel", order, order.volume)
+        if instrument.ENABLED:
+            instrument.count("book.events")
+        levels = self.buy_levels if order.side == "buy" else self.sell_levels
+        level = levels[order.ticks]
+        while level and not level[0].active: ## keep a live order at the front
+            level.popleft()
+        if not level:
+            del levels[order.ticks]
+        return True
+
+    def _pop_filled(self, level, levels, prices, ticks):
+        ## A filled order leaves its queue (with any cancelled orders behind it), and an empty level leaves the heap
+        filled = level.popleft()
+        if filled.order_id is not None:
+            self.orders.pop(filled.order_id, None)
+        while level and not level[0].active:
+            level.popleft()
+        if not level:
+            del levels[ticks]
+            heapq.heappop(prices)
+
+    def match_orders(self):
+        trades = []
+        ## Loops while there are both buyers and sellers
+        while True:
+            top_buy = self._top(self._buy_prices, self.buy_levels, -1)
+            top_sell = self._top(self._sell_prices, self.sell_levels, 1)
+            if top_buy is None or top_sell is None:
+                break
+            best_buy_ticks = -top_buy ## best buyer (highest price) is on top of the buy heap
+            best_sell_ticks = top_sell ## cheapest seller is on top of the sell heap
+
+            if best_buy_ticks < best_sell_ticks: ## no overlap so no trade can be done
+                break
+
+            buy_level = self.buy_levels[best_buy_ticks]
+            sell_level = self.sell_levels[best_sell_ticks]
+            highest_buy = buy_level[0] ## oldest order at the best price goes first
+            highest_sell = sell_level[0]
+
+            trade_qty = min(highest_buy.volume, highest_sell.volume)
+            trade_price_avg = from_ticks(best_buy_ticks + best_sell_ticks)/2 ## Calculates the trade price as the avg of the buying and selling 
             trades.append({"price": trade_price_avg, "quantity" : trade_qty})
-            highest_buy["quanitity"] -= trade_qty
-            highest_sell["quantity"] -= trade_qty
-    
-    ## Making a conditional statement that if buy order is full (0) remove it from the list of buy orders      
-        if highest_buy["quantity"] == 0:
-            self.buy_orders.pop(0) 
-            
-        if highest_sell["quantity"] == 0:
-            self.sell_orders.pop(0)    
-        
-        else: 
-            break 
-    
-    return trades 
+            highest_buy.volume -= trade_qty
+            highest_sell.volume -= trade_qty
+            if self.listeners:
+                self._emit("fill", highest_buy, trade_qty)
+                self._emit("fill", highest_sell, trade_qty)
+
+            if highest_buy.volume == 0:
+                self._pop_filled(buy_level, self.buy_levels, self._buy_prices, best_buy_ticks)
+
+            if highest_sell.volume == 0:
+                self._pop_filled(sell_level, self.sell_levels, self._sell_prices, best_sell_ticks)
+
+        if trades and instrument.ENABLED:
+            instrument.count("book.trades", len(trades))
+        return trades 
 
 """The class Order takes each order and turns it into an object and comparing them in a way 
     that we described in the first section of the code but with min and max. 
     Heaps takes the most appealing order and places it at the top. 
     Once the quantity becomes 0 it's removed from the sysem
-        - Makes it fasters to match buyers and sellers """
+        - Makes it fasters to match buyers and sellers 
+    Every order has an order_id so it can be cancelled or amended later, and a seq number
+    (arrival order) so two orders at the same price keep first come first served
+    __slots__ drops the per-object __dict__, which matters with millions of resting orders"""
 class Order: 
-    def __init__(self, price, volume, side):
-        self.price = price 
+    __slots__ = ("ticks", "volume", "side", "order_id", "seq", "active")
+
+    def __init__(self, price, volume, side, order_id=None):
+        self.ticks = to_ticks(price) ## price kept as integer ticks
         self.volume = volume 
         self.side = side 
+        self.order_id = order_id
+        self.seq = 0 ## set by the book when the order arrives
+        self.active = True ## False once cancelled; the heap entry is left behind as a tombstone
+
+    @property
+    def price(self):
+        return from_ticks(self.ticks)
+
+    def as_dict(self):
+        return {"type": self.side, "price": self.price, "quantity": self.volume}
+
 ## Makes the objects above comparable 
     def __lt__(self, other):
+        if self.ticks == other.ticks:
+            return self.seq < other.seq ## same price: the older order goes first
         if self.side == 'buy':
-            return self.price > other.price 
+            return self.ticks > other.ticks 
         else:
-            return self.price < other.price 
-        
+            return self.ticks < other.ticks 
+
+## Cancels do not dig the order out of the heap (that would mean a full rebuild every time).
+## The order is dropped from the id index and marked inactive, and dead entries are thrown away
+## when they reach the top of the heap. Once too many tombstones pile up the heap is compacted.
 class Orderbook: 
-    def __inti__(self):
+    ## Rebuild a side once more than this share of its heap are tombstones
+    COMPACT_RATIO = 0.5
+    ## Small heaps are never worth rebuilding
+    COMPACT_MIN_SIZE = 64
+
+    def __init__(self):
         self.buy_orders = []
         self.sell_orders = []
+        self.orders = {} ## order_id -> live Order
+        self.tombstones = {'buy': 0, 'sell': 0}
+        self._next_seq = 1
+        self._next_id = 1 ## for orders added without an id; kept apart from seq so it can skip ids callers chose
+        self.listeners = [] ## called as listener(event, side, price, quantity), see OrderBookModel.subscribe
+
+    def subscribe(self, listener):
+        """Registers a callback for "add", "fill" and "cancel" events, like OrderBookModel.subscribe."""
+        self.listeners.append(listener)
+
+    def _emit(self, event, order, quantity):
+        price = order.price
+        for listener in self.listeners:
+            listener(event, order.side, price, quantity)
+
+    def _heap(self, side):
+        return self.buy_orders if side == 'buy' else self.sell_orders
 
     def add_order(self, order):
-        if order.side == 'buy':
-            heapq.heapqpush(self.buy_orders, order) ## heapqpush maintains the heap property 
-        
-        else: 
-            heapq.heappush(self.sell_orders, order)
-            
+        """Adds an order to its side of the book and returns its order_id.
+        An Order object can only be added once; its old heap entry stays behind after a cancel,
+        so re-adding it would put it in the heap twice. Make a new Order instead."""
+        if order.seq:
+            raise ValueError(f"Order {order.order_id} was already added to a book")
+        if not order.volume > 0:
+            raise ValueError(f"Order quantity must be positive, not {order.volume}")
+        if order.order_id is None:
+            while self._next_id in self.orders:
+                self._next_id += 1
+            order.order_id = self._next_id
+            self._next_id += 1
+        if order.order_id in self.orders:
+            raise ValueError(f"Order id {order.order_id} is already in the book")
+        order.seq = self._next_seq
+        self._next_seq += 1
+        order.active = True
+        self.orders[order.order_id] = order
+        heapq.heappush(self._heap(order.side), order) ## heappush maintains the heap property 
+        if self.listeners:
+            self._emit("add", order, order.volume)
+        if instrument.ENABLED:
+            instrument.count("book.events")
+        return order.order_id
+
+    def cancel_order(self, order_id):
+        """Removes an order from the book. Returns False if the id is unknown or already gone."""
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return False
+        order.active = False
+        if self.listeners:
+            self._emit("cancel", order, order.volume)
+        if instrument.ENABLED:
+            instrument.count("book.events")
+        self.tombstones[order.side] += 1
+        self._maybe_compact(order.side)
+        return True
+
+    def modify_order(self, order_id, volume):
+        """Changes the volume of a resting order. Returns False if the id is unknown.
+        Reducing the volume keeps the order's place in the queue, increasing it
+        sends the order to the back of its price like a new order would."""
+        order = self.orders.get(order_id)
+        if order is None:
+            return False
+        if volume <= 0:
+            return self.cancel_order(order_id)
+        if volume <= order.volume:
+            if self.listeners and volume < order.volume:
+                self._emit("cancel", order, order.volume - volume)
+            order.volume = volume
+            return True
+        self.cancel_order(order_id)
+        self.add_order(Order(order.price, volume, order.side, order_id))
+        return True
+
+    def _maybe_compact(self, side):
+        heap = self._heap(side)
+        if len(heap) >= self.COMPACT_MIN_SIZE and self.tombstones[side] > self.COMPACT_RATIO * len(heap):
+            self.compact(side)
+
+    def compact(self, side):
+        """Rebuilds one side of the book without its cancelled entries."""
+        heap = self._heap(side)
+        heap[:] = [order for order in heap if order.active]
+        heapq.heapify(heap)
+        self.tombstones[side] = 0
+
+    def _top(self, side):
+        ## Throws away cancelled orders sitting on top of the heap
+        heap = self._heap(side)
+        while heap and not heap[0].active:
+            heapq.heappop(heap)
+            self.tombstones[side] -= 1
+        return heap[0] if heap else None
+
+    def best_bid(self):
+        """Highest buy price in the book or None if there are no buyers."""
+        top = self._top('buy')
+        return top.price if top is not None else None
+
+    def best_ask(self):
+        """Lowest sell price in the book or None if there are no sellers."""
+        top = self._top('sell')
+        return top.price if top is not None else None
+
     def match_orders(self):
-        while self.buy_orders and self.sell_orders:
-            best_buy = self.buy_orders[0]
-            best_sell = self.sell_orders[0]
-            
-            if best_buy.price > best_sell.price:
-                traded_volume = min(best_buy.volume, best_sell.volume)
-                print(f"Trade executed: {traded_volume} units at {best_sell.volume}")
-                best_buy.volume -= traded_volume 
-                best_sell.volume -= traded_volume 
-            
-            if best_buy == 0: # If order is satisfied then remove it from the heap 
-                heapq.heappush(self.buy_orders)
-                
-            if best_sell == 0:
-                heapq.headpush(self.sell_orders)
-            
-            else:
-                break 
-        
-    
\ No newline at end of file
+        trades = []
+        while True:
+            best_buy = self._top('buy')
+            best_sell = self._top('sell')
+            if best_buy is None or best_sell is None or best_buy.ticks < best_sell.ticks:
+                break
+
+            traded_volume = min(best_buy.volume, best_sell.volume)
+            trades.append({"price": best_sell.price, "quantity": traded_volume})
+            best_buy.volume -= traded_volume 
+            best_sell.volume -= traded_volume 
+            if self.listeners:
+                self._emit("fill", best_buy, traded_volume)
+                self._emit("fill", best_sell, traded_volume)
+
+            if best_buy.volume == 0: # If order is satisfied then remove it from the heap 
+                heapq.heappop(self.buy_orders)
+                del self.orders[best_buy.order_id]
+
+            if best_sell.volume == 0:
+                heapq.heappop(self.sell_orders)
+                del self.orders[best_sell.order_id]
+        if trades and instrument.ENABLED:
+            instrument.count("book.trades", len(trades))
+        return trades
+
+## Timed as stages by instrument.py while instrumentation is enabled; when it is off these
+## stay the plain methods, so the matching loop pays nothing for it
+for book_class in (OrderBookModel, Orderbook):
+    instrument.hook(book_class, "add_order")
+    instrument.hook(book_class, "cancel_order")
+    instrument.hook(book_class, "match_orders")
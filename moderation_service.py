@@ -0,0 +1,187 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+"""Async front end for BannedSpeechPreprocessor.
+Callers send one message at a time with `await service.classify(text)`. Messages are queued
+and grouped into micro-batches: a batch is sent as soon as it has max_batch_size messages, or
+max_wait_ms after its first message arrived, whichever comes first. Each batch runs
+predict_severity_batch on an executor so the event loop never blocks on the model, and every
+caller gets back the same dict predict_severity would have returned.
+The queue is bounded: when it is full classify() waits (backpressure) and classify_nowait()
+raises asyncio.QueueFull so callers can shed load instead."""
+class ModerationService:
+    def __init__(self, preprocessor, max_batch_size=64, max_wait_ms=5.0, max_queue=10_000,
+                 max_inflight=2, executor=None):
+        self.preprocessor = preprocessor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.max_inflight = max_inflight ## batches running on the executor at the same time
+        ## A thread pool shares the trained model in memory. A process pool also works, but then
+        ## the preprocessor is pickled with every batch, so only use one for very slow models
+        self.executor = executor
+        self._own_executor = executor is None
+        self._queue = None
+        self._batcher = None
+        self._running = set()
+        self.running = False ## True between start() and stop()
+        ## Counters
+        self.batches = 0
+        self.messages = 0
+
+    async def start(self):
+        if self._own_executor:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_inflight)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self._batcher = asyncio.create_task(self._batch_loop())
+        self.running = True
+        return self
+
+    async def stop(self):
+        """Finishes every message already queued, then shuts down."""
+        if not self.running:
+            return
+        self.running = False
+        await self._queue.put(None)
+        await self._batcher
+        ## Anything that got in behind the stop marker would never be answered. Every message
+        ## taken out frees a slot for a classify() still blocked on a full queue, so keep going
+        ## until a pass finds nothing (those callers fail themselves, see classify)
+        while True:
+            if self._queue.empty():
+                await asyncio.sleep(0) ## let callers woken by the last pass finish their put
+                if self._queue.empty():
+                    break
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("ModerationService was stopped"))
+        if self._running:
+            await asyncio.gather(*self._running)
+        if self._own_executor:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def classify(self, text):
+        """Moderates one message; waits for queue space if the service is saturated.
+        Raises RuntimeError if the service is not running."""
+        self._check_running()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        ## A put that waited on a full queue can finish after the batcher has stopped
+        if self._batcher.done() and not future.done():
+            future.set_exception(RuntimeError("ModerationService was stopped"))
+        return await future
+
+    def classify_nowait(self, text):
+        """Like classify but raises asyncio.QueueFull instead of waiting. Returns a future."""
+        self._check_running()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return future
+
+    def _check_running(self):
+        if not self.running:
+            raise RuntimeError("ModerationService is not running; call start() first")
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._slots.acquire() ## no more than max_inflight batches on the executor
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.preprocessor.predict_severity_batch, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done(): ## the caller may have given up on it
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+        self.batches += 1
+        self.messages += len(batch)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "mean_batch_size": self.messages / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
+
+async def load_test(service, messages, total=10_000, concurrency=200):
+    """Stand-in client: `concurrency` simulated users each send messages one after another
+    until `total` have been moderated. Returns throughput and latency percentiles."""
+    latencies = []
+    sent = 0
+
+    async def user():
+        nonlocal sent
+        while sent < total:
+            text = messages[sent % len(messages)]
+            sent += 1
+            start = time.perf_counter()
+            await service.classify(text)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "messages": len(latencies),
+        "seconds": elapsed,
+        "messages_per_s": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "service": service.stats(),
+    }
+
+if __name__ == "__main__":
+    from preprocess import BannedSpeechPreprocessor, process_banned_speech
+
+    async def main():
+        preprocessor = BannedSpeechPreprocessor()
+        messages, categories = process_banned_speech(use_file=False)
+        preprocessor.train(messages, categories)
+        async with ModerationService(preprocessor) as service:
+            print(await load_test(service, messages))
+
+    asyncio.run(main())
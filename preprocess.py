@@ -1,15 +1,24 @@
 ## Joson stores ban phrases; shuffle randomizes data to stop order bias 
+import os
+import re
+import gzip
 import json
+import hashlib
+import time
+import threading
+import tracemalloc
+from collections import OrderedDict
+import numpy as np
+import joblib
+import instrument
+from joblib import Parallel, delayed
 from collections import Counter
-from sklearn.svm import SVC
+from sklearn.base import clone
 from sklearn.pipeline import Pipeline
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.ensemble import RandomForestClassifier
-from xgboost import XGBClassifier
-from sklearn.linear_model import LogisticRegression
 from sklearn.utils import shuffle
 from sklearn.exceptions import NotFittedError
-from  sklearn.model_selection import train_test_split
+from  sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.metrics import accuracy_score
 
 #from your_module import bannedSpeechPreprocessor, process_banned_speech
@@ -20,15 +29,217 @@ SEVERITY_LEVELS = {
     2: {"name": "High", "threshold" : 0.6, "action" : "review", "examples": ["I want to slit my wrists"]},
     3: {"name": "Extreme", "threshold" : 0.9, "action" : "block", "examples": ["I hope you get raped and die"]} 
 }
+## Words that push a message's badness up (see key_severity_boost). Entries can be phrases too, e.g. "kill myself"
+SEVERITY_KEYWORDS = (
+    "kill", "killing", "murder", "burn", "burned", "burning",
+    "shoot", "shooting", "shot", "stab", "stabbed", "hang",
+    "bomb", "explode", "explosion", "rape", "raped", "raping",
+    "slaughter", "massacre", "terrorist", "terrorism",
+    "die", "dying", "suicide", "self-harm", "cut", "cutting",
+    "abuse", "abusive", "molest", "molested", "molesting",
+    "assault", "threat", "threaten", "lynch", "genocide",
+    "hate", "hatred", "torture", "suffocate", "strangle",
+    "destroy", "eliminate", "eradicate", "execute", "crucify",
+)
+
+def compile_keyword_pattern(keywords):
+    """Builds one regex matching any of the (lowercase) keywords as whole words; run it on
+    lowercased text. Punctuation around a word does not stop the match ("kill!" counts), the
+    words of a phrase may be split by any whitespace, and longer entries win over their prefixes.
+    The keywords are merged into a prefix tree first (kill(?:ing)?|...), so the regex engine
+    never tries the same prefix twice."""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in " ".join(keyword.lower().split()):
+            node = node.setdefault(char, {})
+        node[""] = {} ## end of a keyword
+
+    def to_regex(node):
+        branches = [(r"\s+" if char == " " else re.escape(char)) + to_regex(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+    return re.compile(r"(?<![\w-])(?:" + to_regex(trie) + r")(?![\w-])")
+
+## Where save_model / load_model keep the trained pipeline by default
+MODEL_PATH = "moderation_model.joblib"
+
+## Processed HateXplain corpora are cached here, one gzip file per source file content
+CORPUS_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".corpus_cache")
+CORPUS_BATCH_SIZE = 10_000
+_READ_SIZE = 1 << 16
+_WHITESPACE = " \t\n\r"
+
+def iter_json_object_items(f, read_size=_READ_SIZE):
+    """Yields (key, value) for each entry of the top-level JSON object in file f without
+    reading the whole file: text is read in read_size blocks and every entry is decoded with
+    json's raw_decode as soon as it is complete, so only one entry is held at a time.
+    Raises json.JSONDecodeError if the file is not a JSON object, is cut short, or has
+    anything but whitespace after the closing brace."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        ## Read at least as much as is still pending, so an entry larger than read_size is
+        ## retried a logarithmic number of times rather than once per block
+        block = f.read(max(read_size, len(buffer) - pos))
+        if not block:
+            eof = True
+        buffer = buffer[pos:] + block ## drop what has been decoded already
+        pos = 0
+
+    def skip(chars):
+        ## Moves past any of chars, reading more when the buffer runs out; returns the next character
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ""
+            fill()
+
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buffer) and not eof: ## a number may continue in the next block
+                fill()
+                continue
+            pos = end
+            return value
+
+    if skip(_WHITESPACE) != "{":
+        raise json.JSONDecodeError("Expecting '{'", buffer, pos)
+    pos += 1
+    char = skip(_WHITESPACE)
+    while char != "}": ## an empty object skips the loop
+        if char != '"':
+            raise json.JSONDecodeError("Expecting property name", buffer, pos)
+        key = decode()
+        if skip(_WHITESPACE) != ":":
+            raise json.JSONDecodeError("Expecting ':'", buffer, pos)
+        pos += 1
+        skip(_WHITESPACE)
+        yield key, decode()
+        ## Exactly one comma between entries and none before the closing brace
+        char = skip(_WHITESPACE)
+        if char == ",":
+            pos += 1
+            char = skip(_WHITESPACE)
+            if char != '"':
+                raise json.JSONDecodeError("Expecting property name", buffer, pos)
+        elif char != "}":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+    pos += 1
+    if skip(_WHITESPACE):
+        raise json.JSONDecodeError("Extra data", buffer, pos)
+
+def hateexplain_label(post_data):
+    """Majority vote of the annotators mapped to 'BAD' (hatespeech, offensive) or 'Good' (normal).
+    A tie counts as 'BAD'. Returns None when no annotator gave a known label."""
+    mapped_labels = []
+    for ann in post_data['annotators']:
+        label = ann['label'].lower()
+        if label in ["hatespeech", "offensive"]:
+            mapped_labels.append("BAD")
+        elif label == "normal":
+            mapped_labels.append("Good")
+        # Ignore any other unexpected labels
+    if not mapped_labels:
+        return None
+    label_counts = Counter(mapped_labels)
+    return "BAD" if label_counts.get("BAD", 0) >= label_counts.get("Good", 0) else "Good"
+
+def corpus_cache_path(filepath, cache_dir=CORPUS_CACHE_DIR):
+    """Cache file for one version of a corpus, named after the SHA-256 of its content
+    (the file is hashed in blocks, never loaded whole)."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return os.path.join(cache_dir, digest.hexdigest() + ".jsonl.gz")
+
+def _batched(pairs, batch_size):
+    messages, labels = [], []
+    for message, label in pairs:
+        messages.append(message)
+        labels.append(label)
+        if len(messages) == batch_size:
+            yield messages, labels
+            messages, labels = [], []
+    if messages:
+        yield messages, labels
+
+def _read_corpus_cache(cache_path):
+    ## One post per line: the label's first letter, then the message as a JSON string
+    with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line[1:]), "BAD" if line[0] == "B" else "Good"
+
+def _parse_and_cache(filepath, cache_path):
+    ## Written to a temporary name and renamed at the end, so a parse that fails or is
+    ## abandoned halfway never leaves a partial cache behind
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f, gzip.open(tmp_path, 'wt', encoding='utf-8') as out:
+            for post_id, post_data in iter_json_object_items(f):
+                label = hateexplain_label(post_data)
+                if label is None: # Skip if no valid labels were found
+                    continue
+                message = " ".join(post_data['post_tokens'])
+                out.write(label[0] + json.dumps(message, ensure_ascii=False) + "\n")
+                yield message, label
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def iter_hateexplain_batches(filepath="hate_speech.json", batch_size=CORPUS_BATCH_SIZE, cache_dir=CORPUS_CACHE_DIR):
+    """Streams a HateXplain-style corpus ({post_id: {"post_tokens", "annotators"}}) as
+    (messages, labels) batches of up to batch_size posts, with labels 'BAD' / 'Good'.
+    The first pass parses the JSON incrementally and writes the processed posts to a gzip
+    cache keyed by the file's hash; later passes over the same content read only the cache.
+    Memory stays bounded by one batch whatever the size of the corpus.
+    cache_dir=None turns the cache off."""
+    if cache_dir is None:
+        def parse():
+            with open(filepath, 'r', encoding='utf-8') as f:
+                for post_id, post_data in iter_json_object_items(f):
+                    label = hateexplain_label(post_data)
+                    if label is not None:
+                        yield " ".join(post_data['post_tokens']), label
+        pairs = parse()
+    else:
+        cache_path = corpus_cache_path(filepath, cache_dir)
+        if os.path.exists(cache_path):
+            pairs = _read_corpus_cache(cache_path)
+        else:
+            pairs = _parse_and_cache(filepath, cache_path)
+    yield from _batched(pairs, batch_size)
+
 ## OR if file mock code for upload file 
-def load_and_process_hateexplain_data(filepath = "hate_speech.json"): 
+def load_and_process_hateexplain_data(filepath = "hate_speech.json", cache_dir=CORPUS_CACHE_DIR): 
     
     messages = []
     categories = []
 
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        for batch_messages, batch_labels in iter_hateexplain_batches(filepath, cache_dir=cache_dir):
+            messages.extend(batch_messages)
+            categories.extend(batch_labels)
     except FileNotFoundError:
         print(f"Error: {filepath} not found. Please ensure the 'hate_speech.json' file is in the correct directory.")
         return [], []
@@ -36,37 +247,6 @@ def load_and_process_hateexplain_data(filepath = "hate_speech.json"):
         print(f"Error: Could not decode JSON from {filepath}. Check file integrity.")
         return [], []
 
-    for post_id, post_data in data.items():
-        # Join tokens to form the full message
-        message = " ".join(post_data['post_tokens'])
-        
-        # Get labels from all annotators for this post
-        annotator_labels = [ann['label'] for ann in post_data['annotators']]
-        
-        # Map HateXplain labels to your 'BAD'/'Good' categories
-        mapped_labels = []
-        for label in annotator_labels:
-            if label.lower() in ["hatespeech", "offensive"]:
-                mapped_labels.append("BAD")
-            elif label.lower() == "normal":
-                mapped_labels.append("Good")
-            # Ignore any other unexpected labels
-        
-        if not mapped_labels: # Skip if no valid labels were found
-            continue
-
-        # Determine the final label by majority vote
-        label_counts = Counter(mapped_labels)
-        
-        # Prioritize 'BAD' if it's the majority or a tie
-        if label_counts.get("BAD", 0) >= label_counts.get("Good", 0):
-            final_label = "BAD"
-        else:
-            final_label = "Good"
-            
-        messages.append(message)
-        categories.append(final_label)
-
     return messages, categories
 # Print the loaded banned speech to verify
 #print(banned_speech)
@@ -76,23 +256,6 @@ def process_banned_speech(use_file=True, filename="hate_speech.json"):
     if use_file and filename:
         messages, categories = load_and_process_hateexplain_data(filename)
         return messages, categories
-    else:
-        print("Using written data (hardcoded defaults).")
-        banned_data_dict = {
-            "BAD": [...],
-            "Good": [...]
-        }
-        max_samples = min(len(banned_data_dict["BAD"]), len(banned_data_dict["Good"]))
-        balanced_messages = []
-        balanced_categories = []
-        for i in range(max_samples):
-            balanced_messages.append(banned_data_dict["BAD"][i].lower().strip())
-            balanced_categories.append("BAD")
-            balanced_messages.append(banned_data_dict["Good"][i].lower().strip())
-            balanced_categories.append("Good")
-        balanced_messages, balanced_categories = shuffle(balanced_messages, balanced_categories, random_state=42)
-        return balanced_messages, balanced_categories
-
     else: 
             print("Using written data (hardcoded defaults).")
             banned_data_dict = {
@@ -137,6 +300,77 @@ def process_banned_speech(use_file=True, filename="hate_speech.json"):
             
     balanced_messages, balanced_categories = shuffle(balanced_messages, balanced_categories, random_state=42)
     return balanced_messages, balanced_categories
+## Remembers verdicts for messages seen recently (spam, copypasta, re-sent messages)
+class VerdictCache:
+    """LRU cache of predict_severity results keyed on normalized text (lowercased and stripped,
+    like process_banned_speech does to the training data). Entries expire after ttl_seconds, the
+    least recently used entry goes when max_size is reached, and everything is dropped when the
+    model version changes (i.e. after a retrain).
+    Safe to share between threads (ModerationService runs several batches at once)."""
+    def __init__(self, max_size=10_000, ttl_seconds=300.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict() ## key -> (expires at, result)
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        ## A lock cannot be pickled (e.g. when the preprocessor is sent to a process pool)
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text):
+        return text.lower().strip()
+
+    def _check_version(self, version):
+        ## Called with the lock held
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get(self, text, version):
+        """Cached result for text (with its own "text" filled in) or None."""
+        key = self.normalize(text)
+        with self.lock:
+            self._check_version(version)
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return dict(entry[1], text=text)
+
+    def put(self, text, version, result):
+        key = self.normalize(text)
+        with self.lock:
+            self._check_version(version)
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            hits, misses, size = self.hits, self.misses, len(self.entries)
+        lookups = hits + misses
+        return {"hits": hits, "misses": misses, "size": size,
+                "hit_rate": hits / lookups if lookups else 0.0}
+
 ## Ignore Unnecessary words 
 class BannedSpeechPreprocessor: # Class names typically start with a capital letter
     ## JSON stores ban phrases; shuffle randomizes data to stop order bias
@@ -149,49 +383,69 @@ class BannedSpeechPreprocessor: # Class names typically start with a capital let
         3: {"name": "Extreme", "threshold": 0.9, "action": "block", "examples": ["I hope you get raped and die"]}
     }
 
-def load_and_process_hateexplain_data(filepath="hate_speech.json"):
-    messages, categories = [], []
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: {filepath} not found. Please ensure it's in the correct directory.")
-        return [], []
-    except json.JSONDecodeError:
-        print(f"Error: Could not decode JSON from {filepath}. Check file integrity.")
-        return [], []
+    def __init__(self, severity_keywords=SEVERITY_KEYWORDS, cache_size=10_000, cache_ttl=300.0,
+                 severity_levels=None, pipeline=None):
+        ## Compiled once here instead of rebuilding the keyword set on every message
+        self.severity_keywords = tuple(severity_keywords)
+        self.keyword_pattern = compile_keyword_pattern(self.severity_keywords)
+        self.severity_levels = severity_levels if severity_levels is not None else SEVERITY_LEVELS
+        ## cache_size=0 turns the verdict cache off
+        self.cache = VerdictCache(cache_size, cache_ttl) if cache_size else None
+        self.model_version = 0 ## goes up on every (re)train so cached verdicts are dropped
+        ## Cascade mode (see train_cascade): a cheap screen model in front of the pipeline's classifier
+        self.cascade = False
+        self.screen = None
+        self.screen_for = None ## (model_version, pipeline id) the screen was trained against
+        self.cascade_band = 0.05
+        self.cascade_stats = {"messages": 0, "escalated": 0}
+        self.stats_lock = threading.Lock() ## cascade_stats are updated from the service's worker threads
+        if pipeline is not None: ## an already trained pipeline, e.g. from load_model
+            self.pipeline = pipeline
+            self.model_version = 1
+            return
+        from sklearn.ensemble import RandomForestClassifier
+        self.pipeline = Pipeline([
+            ('vectorizer', TfidfVectorizer(
+                stop_words='english',  # stops words like "the, etc."
+                ngram_range=(1, 2)  # checks single words and pairs of words
+            )),
+            # Default classifier; can be replaced by auto_train_model
+            ('classifier', RandomForestClassifier(
+                class_weight='balanced',
+                random_state=42
+            ))
+        ])
+    def __getstate__(self):
+        ## Locks cannot be pickled (e.g. when ModerationService runs on a process pool)
+        state = self.__dict__.copy()
+        del state["stats_lock"]
+        state["screen_current"] = self.screen is not None and self.screen_for == (self.model_version, id(self.pipeline))
+        return state
 
-    for post_id, post_data in data.i:
+    def __setstate__(self, state):
+        screen_current = state.pop("screen_current", False)
+        self.__dict__.update(state)
+        self.stats_lock = threading.Lock()
+        if screen_current: ## the copy has a new pipeline id; keep the screen tied to it
+            self.screen_for = (self.model_version, id(self.pipeline))
 
-        def __init__(self):
-            self.pipeline = Pipeline([
-                ('vectorizer', TfidfVectorizer(
-                    stop_words='english',  # stops words like "the, etc."
-                    ngram_range=(1, 2)  # checks single words and pairs of words
-                )),
-                # Default classifier; can be replaced by auto_train_model
-                ('classifier', RandomForestClassifier(
-                    class_weight='balanced',
-                    random_state=42
-                ))
-            ])
     #Adding key words that add
     def key_severity_boost(self, text):
-        extreme_words = { 
-            "kill", "killing", "murder", "burn", "burned", "burning",
-            "shoot", "shooting", "shot", "stab", "stabbed", "hang",
-            "bomb", "explode", "explosion", "rape", "raped", "raping",
-            "slaughter", "massacre", "terrorist", "terrorism",
-            "die", "dying", "suicide", "self-harm", "cut", "cutting",
-            "abuse", "abusive", "molest", "molested", "molesting",
-            "assault", "threat", "threaten", "lynch", "genocide",
-            "hate", "hatred", "torture", "suffocate", "strangle",
-            "destroy", "eliminate", "eradicate", "execute", "crucify"}
-        
-        words = text.lower().split()
-        count = sum(1 for words in words if words in extreme_words)
+        count = len(self.keyword_pattern.findall(text.lower()))
         boost = min(0.05*count, 0.2) # Ensures boost does not exceed 40% 
         return boost
+
+    def key_severity_boost_batch(self, texts):
+        """key_severity_boost for a list of messages, as an array. The messages are joined
+        with a NUL separator (never part of a word or of the whitespace inside a phrase) and
+        scanned with a single regex pass; each match is mapped back to its message by offset."""
+        texts = [text.lower() for text in texts]
+        if not texts:
+            return np.zeros(0)
+        ends = np.cumsum([len(text) + 1 for text in texts])
+        starts = [match.start() for match in self.keyword_pattern.finditer("\0".join(texts))]
+        counts = np.bincount(np.searchsorted(ends, starts, side="right"), minlength=len(texts))
+        return np.minimum(0.05 * counts, 0.2)
     
         
     def train(self, messages, categories):
@@ -200,11 +454,48 @@ def load_and_process_hateexplain_data(filepath="hate_speech.json"):
     # categories: list of corresponding labels (e.g., 0 for benign, 1 for banned)
         print("Training begins...")
         self.pipeline.fit(messages, categories)   
+        self.model_version += 1
         print("Training Complete")
         
+    def train_incremental(self, batches, classes=("BAD", "Good"), n_features=2**20, warm_start=False):
+        """Trains from an iterable of (messages, categories) mini-batches, e.g.
+        iter_hateexplain_batches(...), holding only one batch in memory at a time.
+        Uses a stateless HashingVectorizer (no vocabulary to grow, n_features fixed up front)
+        and an SGD logistic regression updated with partial_fit, so the model size does not
+        depend on the corpus size. classes must list every label that can appear.
+        With warm_start=True an earlier incremental model keeps learning from the new batches
+        instead of starting over, to fold in newly labeled data without a full retrain.
+        Returns the number of batches and messages seen and the training time."""
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.linear_model import SGDClassifier
+        if not (warm_start and isinstance(self.pipeline.named_steps['vectorizer'], HashingVectorizer)):
+            self.pipeline = Pipeline([
+                ('vectorizer', HashingVectorizer(
+                    stop_words='english',
+                    ngram_range=(1, 2),
+                    alternate_sign=False, # keeps every feature count positive, like TF-IDF
+                    n_features=n_features
+                )),
+                ('classifier', SGDClassifier(loss='log_loss', random_state=42))
+            ])
+        vectorizer = self.pipeline.named_steps['vectorizer']
+        classifier = self.pipeline.named_steps['classifier']
+
+        print("Incremental training begins...")
+        start = time.perf_counter()
+        batch_count = message_count = 0
+        for messages, categories in batches:
+            classifier.partial_fit(vectorizer.transform(messages), list(categories), classes=list(classes))
+            batch_count += 1
+            message_count += len(messages)
+        seconds = time.perf_counter() - start
+        self.model_version += 1
+        print(f"Incremental training complete: {message_count} messages in {batch_count} batches, {seconds:.2f}s")
+        return {"batches": batch_count, "messages": message_count, "seconds": seconds}
+
     def calc_confidence(self, proba):
         "Calculates a confidence score of the severity of the text "
-        thresholds = [level["threshold"] for level in SEVERITY_LEVELS.values()]
+        thresholds = [level["threshold"] for level in self.severity_levels.values()]
         
         if not thresholds:
             return 0.0 # Default 
@@ -215,10 +506,120 @@ def load_and_process_hateexplain_data(filepath="hate_speech.json"):
         nearest_threshold = min(thresholds, key=lambda x: abs(x - proba))
         return round(1 - abs(proba - nearest_threshold), 4) 
     
+    def _cache_version(self):
+        ## Also catches a pipeline being swapped in by hand, and cascade mode being switched
+        version = (self.model_version, id(self.pipeline))
+        return version + (id(self.screen) if self._cascade_active() else None,)
+
+    def _cascade_active(self):
+        ## The screen only works on the vectorizer it was trained with, so it is ignored after a retrain
+        return self.cascade and self.screen is not None and self.screen_for == (self.model_version, id(self.pipeline))
+
+    def train_cascade(self, messages, categories, band=None):
+        """Turns on cascade mode. A LogisticRegression screen is trained on the features of the
+        already trained pipeline's own vectorizer, so both models share one transform. Every
+        message is scored by the screen first; only messages whose boosted probability lies
+        within `band` of a severity threshold above 0 (0.3 / 0.6 / 0.9) are sent on to the
+        heavy classifier, the rest keep the screen's probability.
+        band is a half-width for every threshold, or a {threshold: half-width} dict.
+        Retraining the pipeline switches the cascade off until train_cascade is called again."""
+        from sklearn.linear_model import LogisticRegression
+        X = self.pipeline.named_steps['vectorizer'].transform(messages)
+        self.screen = LogisticRegression(class_weight='balanced', max_iter=1000)
+        self.screen.fit(X, list(categories))
+        self.screen_for = (self.model_version, id(self.pipeline))
+        if band is not None:
+            self.cascade_band = band
+        self.cascade = True
+        self.cascade_stats = {"messages": 0, "escalated": 0}
+
+    def _escalation_mask(self, proba):
+        ## True where a (boosted) screen probability is close enough to a threshold to need the heavy model
+        band = self.cascade_band
+        escalate = np.zeros(len(proba), dtype=bool)
+        for info in self.severity_levels.values():
+            threshold = info["threshold"]
+            if threshold <= 0: ## every probability is above the Safe threshold
+                continue
+            width = band.get(threshold, 0.0) if isinstance(band, dict) else band
+            escalate |= np.abs(proba - threshold) <= width
+        return escalate
+
+    def _bad_proba(self, texts, boost, cascade=None, stats=None):
+        ## "BAD" probability before the boost is added, through the cascade when it is on
+        ## (cascade=True / False forces a path without touching self.cascade). Escalations are
+        ## counted into stats when given, else into cascade_stats.
+        ## Same as pipeline.predict_proba, with the transform and the classifier timed apart
+        with instrument.stage("moderation.transform"):
+            X = texts
+            for _, step in self.pipeline.steps[:-1]:
+                X = step.transform(X)
+        classifier = self.pipeline.steps[-1][1]
+        if cascade is None:
+            cascade = self._cascade_active()
+        if not cascade:
+            with instrument.stage("moderation.predict_proba"):
+                return classifier.predict_proba(X)[:, self._bad_column()]
+        with instrument.stage("moderation.screen"):
+            proba = self.screen.predict_proba(X)[:, _bad_index(self.screen.classes_)]
+        escalate = self._escalation_mask(np.minimum(proba + boost, 1.0))
+        if escalate.any():
+            with instrument.stage("moderation.predict_proba"):
+                proba[escalate] = classifier.predict_proba(X[escalate])[:, self._bad_column()]
+        if stats is not None:
+            stats["messages"] += len(texts)
+            stats["escalated"] += int(escalate.sum())
+            return proba
+        with self.stats_lock:
+            self.cascade_stats["messages"] += len(texts)
+            self.cascade_stats["escalated"] += int(escalate.sum())
+        instrument.count("moderation.escalated", int(escalate.sum()))
+        return proba
+
+    def cascade_report(self):
+        """How many messages the cascade has scored and what share went to the heavy model."""
+        with self.stats_lock:
+            messages, escalated = self.cascade_stats["messages"], self.cascade_stats["escalated"]
+        return {"messages": messages, "escalated": escalated,
+                "escalation_rate": escalated / messages if messages else 0.0}
+
+    def evaluate_cascade(self, messages):
+        """Runs messages through the full pipeline and through the cascade and compares them:
+        share of messages given the same severity tier, escalation rate, and mean time per
+        message of each path. The verdict cache is bypassed and neither cascade mode nor
+        cascade_stats is touched, so it can run while the preprocessor is serving other threads."""
+        if not self._cascade_active():
+            raise ValueError("Cascade mode is not active; call train_cascade first")
+        messages = list(messages)
+        stats = {"messages": 0, "escalated": 0}
+        start = time.perf_counter()
+        full = self._predict_batch(messages, cascade=False)
+        full_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        cascaded = self._predict_batch(messages, cascade=True, stats=stats)
+        cascade_seconds = time.perf_counter() - start
+        agree = sum(a["severity_level"] == b["severity_level"] for a, b in zip(full, cascaded))
+        count = max(len(messages), 1)
+        return {
+            "messages": len(messages),
+            "escalation_rate": stats["escalated"] / stats["messages"] if stats["messages"] else 0.0,
+            "tier_agreement": agree / count,
+            "full_ms_per_message": full_seconds * 1000 / count,
+            "cascade_ms_per_message": cascade_seconds * 1000 / count,
+        }
+
     def  predict_severity(self, text):
+        if self.cache is not None:
+            cached = self.cache.get(text, self._cache_version())
+            if cached is not None:
+                instrument.count("moderation.cache_hits")
+                return cached
+            instrument.count("moderation.cache_misses")
+        with instrument.stage("moderation.boost"):
+            boost = self.key_severity_boost(text)  # Optional boosting function
         try:
             # Predict probability of the text being "bad" (class 1)
-            proba = self.pipeline.predict_proba([text])[0][1]
+            proba = self._bad_proba([text], np.array([boost]))[0]
         except NotFittedError:
             return {
                 "text": text,
@@ -236,69 +637,261 @@ def load_and_process_hateexplain_data(filepath="hate_speech.json"):
                 "confidence": 0.0
             }
 
-        # This line was incorrectly placed inside the exception block before.
-        boost = self.key_severity_boost(text)  # Optional boosting function
         proba = min(proba + boost, 1.0)  # Cap at 100%
 
         # Determine the severity level based on probability thresholds
-        sorted_levels = sorted(SEVERITY_LEVELS.keys(), key=lambda k: SEVERITY_LEVELS[k]["threshold"], reverse=True)
-        severity_info = SEVERITY_LEVELS[0]  # Default to "Safe"
+        with instrument.stage("moderation.tiering"):
+            severity_levels = self.severity_levels
+            sorted_levels = sorted(severity_levels.keys(), key=lambda k: severity_levels[k]["threshold"], reverse=True)
+            severity_info = severity_levels[0]  # Default to "Safe"
 
-        for level_key in sorted_levels:
-            info = SEVERITY_LEVELS[level_key]
-            if proba >= info["threshold"]:
-                severity_info = info
-                break
+            for level_key in sorted_levels:
+                info = severity_levels[level_key]
+                if proba >= info["threshold"]:
+                    severity_info = info
+                    break
 
-        return {
-            "text": text,
-            "badness_proba": round(proba * 100, 2),
-            "severity_level": severity_info["name"],
-            "action": severity_info["action"],
-            "confidence": self.calc_confidence(proba)
-        }
-    def auto_train_model(self, messages, categories):
+            result = {
+                "text": text,
+                "badness_proba": round(proba * 100, 2),
+                "severity_level": severity_info["name"],
+                "action": severity_info["action"],
+                "confidence": self.calc_confidence(proba)
+            }
+        if self.cache is not None:
+            self.cache.put(text, self._cache_version(), result)
+        return result
+    def _bad_column(self):
+        ## Column of predict_proba holding the "BAD" probability. With "BAD"/"Good" labels the
+        ## classes are sorted alphabetically so "BAD" is column 0; with 0/1 labels it is class 1
+        return _bad_index(getattr(self.pipeline, "classes_", []))
+
+    def predict_severity_batch(self, texts):
+        """predict_severity for many messages at once. The whole batch goes through one
+        TF-IDF transform and one predict_proba call, and the boost, severity tier and confidence
+        are worked out as array operations. Returns the same result dicts, in the same order.
+        Messages found in the verdict cache (and repeats within the batch) are not re-run."""
+        texts = list(texts)
+        instrument.record("moderation.batch_size", len(texts))
+        if self.cache is None:
+            return self._predict_batch(texts)
+
+        version = self._cache_version()
+        results = [self.cache.get(text, version) for text in texts]
+        ## Each distinct message that missed the cache is predicted once
+        pending = {}
+        for i, result in enumerate(results):
+            if result is None:
+                pending.setdefault(VerdictCache.normalize(texts[i]), []).append(i)
+        if instrument.ENABLED:
+            misses = sum(result is None for result in results)
+            instrument.count("moderation.cache_hits", len(texts) - misses)
+            instrument.count("moderation.cache_misses", misses)
+        if pending:
+            first = [indexes[0] for indexes in pending.values()]
+            for indexes, result in zip(pending.values(), self._predict_batch([texts[i] for i in first])):
+                if result["severity_level"] != "Error":
+                    self.cache.put(texts[indexes[0]], version, result)
+                for i in indexes:
+                    results[i] = dict(result, text=texts[i])
+        return results
+
+    def _predict_batch(self, texts, cascade=None, stats=None):
+        ## cascade and stats are passed on to _bad_proba
+        if not texts:
+            return []
+        with instrument.stage("moderation.boost"):
+            boost = self.key_severity_boost_batch(texts)
+        try:
+            proba = self._bad_proba(texts, boost, cascade, stats)
+        except NotFittedError:
+            return [{
+                "text": text,
+                "badness_proba": 0.0,
+                "severity_level": "Error",
+                "action": "Model not trained. Please train the model first.",
+                "confidence": 0.0
+            } for text in texts]
+        except Exception as e:
+            return [{
+                "text": text,
+                "badness_proba": 0.0,
+                "severity_level": "Error",
+                "action": f"Prediction failed: {e}",
+                "confidence": 0.0
+            } for text in texts]
+
+        proba = np.minimum(proba + boost, 1.0)  # Cap at 100%
+
+        with instrument.stage("moderation.tiering"):
+            # Severity tier: the highest threshold the probability reaches (Safe if none)
+            levels = sorted(self.severity_levels.values(), key=lambda info: info["threshold"])
+            thresholds = np.array([info["threshold"] for info in levels])
+            tier = np.clip(np.searchsorted(thresholds, proba, side="right") - 1, 0, None)
+            # Confidence: 1 - distance to the nearest threshold, as in calc_confidence
+            confidence = 1 - np.abs(proba[:, None] - thresholds[None, :]).min(axis=1)
+
+            return [{
+                "text": text,
+                "badness_proba": round(p * 100, 2),
+                "severity_level": levels[t]["name"],
+                "action": levels[t]["action"],
+                "confidence": round(c, 4)
+            } for text, p, t, c in zip(texts, proba.tolist(), tier.tolist(), confidence.tolist())]
+
+    def save_model(self, path=MODEL_PATH):
+        """Saves the trained pipeline (vectorizer vocabulary + classifier) and the severity
+        config. The file is written uncompressed so load_model can memory-map its arrays."""
+        joblib.dump({
+            "pipeline": self.pipeline,
+            "severity_levels": self.severity_levels,
+            "severity_keywords": self.severity_keywords,
+            "cascade": (self.screen, self.cascade_band) if self._cascade_active() else None,
+        }, path)
+
+    @classmethod
+    def load_model(cls, path=MODEL_PATH, mmap=True, **kwargs):
+        """Builds a ready-to-serve preprocessor from a save_model file without any training.
+        With mmap=True the large NumPy arrays (IDF weights, coefficients) are memory-mapped
+        read-only instead of copied, so loading is quick and workers share the pages."""
+        saved = joblib.load(path, mmap_mode="r" if mmap else None)
+        preprocessor = cls(severity_keywords=saved["severity_keywords"], severity_levels=saved["severity_levels"],
+                           pipeline=saved["pipeline"], **kwargs)
+        if saved.get("cascade") is not None:
+            preprocessor.screen, preprocessor.cascade_band = saved["cascade"]
+            preprocessor.screen_for = (preprocessor.model_version, id(preprocessor.pipeline))
+            preprocessor.cascade = True
+        return preprocessor
+
+    def auto_train_model(self, messages, categories, cv=None, n_jobs=-1, early_stopping_rounds=10,
+                         measure_memory=False):
         """
         Automatically trains the model based on provided messages and categories.
+        Tries every classifier in candidate_classifiers() and keeps the most accurate one.
+
+        The TF-IDF vectorizer is fitted once per train/validation split and the same sparse
+        matrix is shared by all candidates, which are trained in parallel (n_jobs processes,
+        -1 = all cores). Labels are encoded as 1 for "BAD" and 0 otherwise.
 
         Args:
-            messages (_type_): _description_
-            categories (_type_): _description_
+            messages: list of text messages
+            categories: matching list of labels ("BAD" / "Good")
+            cv: None for a single 80/20 split, or a number of stratified folds to average the
+                accuracy over (the winner is then refitted on all the data)
+            n_jobs: parallel workers for the candidates
+            early_stopping_rounds: XGBoost stops adding trees once the loss on a slice held out
+                of its training data has not improved for this many rounds (None to train all
+                of them). The validation data used to pick the winner is never used for this
+            measure_memory: also refit every candidate under tracemalloc for its peak memory.
+                This is a second fit, so the timings are not slowed down by the tracing
+        Returns a list with accuracy, training seconds and peak memory (None unless
+        measure_memory) per candidate (and fold).
         """
         print("Auto-training model with classifiers...")
-        X_train, X_val, y_train, y_val = train_test_split(messages, categories, test_size=0.2, random_state=42)
+        messages = list(messages)
+        labels = np.array([1 if category in ("BAD", 1) else 0 for category in categories])
+        if cv:
+            folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=42).split(messages, labels)
+        else:
+            folds = [train_test_split(np.arange(len(messages)), test_size=0.2, random_state=42)]
 
-        classifiers = { 
-            "XGBoost": XGBClassifier(use_label_encoder=False, eval_metric='logloss'),
-            "SVC": SVC(probability=True, kernel='linear', class_weight='balanced'),
-            "Logistic Regression": LogisticRegression(class_weight='balanced', max_iter=1000)
-        }
-        best_model = None 
-        best_score = 0.0
-        best_name = "" 
-        
-        for name, model in classifiers.items():
-            pipeline = Pipeline([
-                ('vectorizer', TfidfVectorizer(stop_words='english', ngram_range=(1, 2))),
-                ('classifier', model)
-            ])
-            pipeline.fit(X_train, y_train) 
-            preds = pipeline.predict(X_val)
-            score = accuracy_score(y_val, preds)
-            
-            print(f"{name.upper()} accuracy: {score:.4f}")
-            if score > best_score:
-                best_score = score
-                best_model = pipeline
-                best_name = name
-        if best_model is not None:
-            self.pipeline = best_model
-            print(f"Selected model: {best_name.upper()} with accuracy {best_score:.4f}")
+        jobs = []
+        fold_vectorizers = []
+        for fold, (train_index, val_index) in enumerate(folds):
+            vectorizer = TfidfVectorizer(stop_words='english', ngram_range=(1, 2))
+            X_train = vectorizer.fit_transform([messages[i] for i in train_index])
+            X_val = vectorizer.transform([messages[i] for i in val_index])
+            fold_vectorizers.append(vectorizer)
+            for name, model in candidate_classifiers().items():
+                jobs.append(delayed(_fit_candidate)(name, fold, model, X_train, labels[train_index],
+                                                    X_val, labels[val_index], early_stopping_rounds,
+                                                    measure_memory))
+
+        start = time.perf_counter()
+        report = Parallel(n_jobs=n_jobs)(jobs)
+        print(f"Trained {len(report)} candidate fits in {time.perf_counter() - start:.2f}s")
+
+        scores = {}
+        for row in report:
+            memory = f" | peak {row['peak_memory_bytes'] / 1e6:.1f} MB" if measure_memory else ""
+            print(f"{row['name'].upper()} (fold {row['fold']}) accuracy: {row['accuracy']:.4f} | "
+                  f"{row['seconds']:.2f}s{memory}")
+            scores.setdefault(row['name'], []).append(row['accuracy'])
+        best_name = max(scores, key=lambda name: np.mean(scores[name]))
+        best_score = float(np.mean(scores[best_name]))
+
+        if cv:
+            vectorizer = TfidfVectorizer(stop_words='english', ngram_range=(1, 2))
+            X_all = vectorizer.fit_transform(messages)
+            model = candidate_classifiers()[best_name]
+            _fit(best_name, model, X_all, labels, early_stopping_rounds) ## the same setup that was scored
+        else:
+            vectorizer = fold_vectorizers[0]
+            model = next(row['model'] for row in report if row['name'] == best_name)
+        self.pipeline = Pipeline([('vectorizer', vectorizer), ('classifier', model)])
+        self.model_version += 1
+        print(f"Selected model: {best_name.upper()} with accuracy {best_score:.4f}")
+        for row in report:
+            del row['model']
+        self.training_report = report
+        return report
+
+def _bad_index(classes):
+    classes = list(classes)
+    return classes.index("BAD") if "BAD" in classes else 1
+
+def candidate_classifiers():
+    """Fresh, unfitted copies of the classifiers auto_train_model chooses between."""
+    ## Imported here so that loading a saved model does not pay for every classifier library
+    from sklearn.svm import SVC
+    from xgboost import XGBClassifier
+    from sklearn.linear_model import LogisticRegression
+    return { 
+        "XGBoost": XGBClassifier(eval_metric='logloss'),
+        "SVC": SVC(probability=True, kernel='linear', class_weight='balanced'),
+        "Logistic Regression": LogisticRegression(class_weight='balanced', max_iter=1000)
+    }
+
+def _fit(name, model, X_train, y_train, early_stopping_rounds):
+    if early_stopping_rounds and name == "XGBoost":
+        ## Early stopping watches its own 10% of the training data, so that X_val stays unseen
+        ## until the candidates are scored on it
+        stratify = y_train if np.bincount(y_train).min() >= 2 else None
+        X_fit, X_stop, y_fit, y_stop = train_test_split(X_train, y_train, test_size=0.1,
+                                                        random_state=42, stratify=stratify)
+        model.set_params(early_stopping_rounds=early_stopping_rounds)
+        model.fit(X_fit, y_fit, eval_set=[(X_stop, y_stop)], verbose=False)
+    else:
+        model.fit(X_train, y_train)
+
+def _fit_candidate(name, fold, model, X_train, y_train, X_val, y_val, early_stopping_rounds,
+                   measure_memory=False):
+    ## One candidate on one split, run inside a joblib worker. Peak memory comes from a second
+    ## fit under tracemalloc (only Python and NumPy; native buffers inside XGBoost are not seen)
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+        _fit(name, clone(model), X_train, y_train, early_stopping_rounds)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    start = time.perf_counter()
+    _fit(name, model, X_train, y_train, early_stopping_rounds)
+    seconds = time.perf_counter() - start
+    return {
+        "name": name,
+        "fold": fold,
+        "accuracy": accuracy_score(y_val, model.predict(X_val)),
+        "seconds": seconds,
+        "peak_memory_bytes": peak,
+        "model": model,
+    }
     
-preprocessor =  BannedSpeechPreprocessor()
-messages_to_train, categories_to_train = process_banned_speech(use_file=True, filename="banned_speech.json")
-preprocessor.auto_train_model(messages_to_train, categories_to_train)
-test_messages = [
+if __name__ == "__main__": 
+    preprocessor =  BannedSpeechPreprocessor()
+    messages_to_train, categories_to_train = process_banned_speech(use_file=True, filename="banned_speech.json")
+    preprocessor.auto_train_model(messages_to_train, categories_to_train)
+    preprocessor.save_model(MODEL_PATH)
+    test_messages = [
         "Let's burn them alive",
         "I hope you get raped and die",
         "Can I tell you something important.",
@@ -312,8 +905,7 @@ test_messages = [
         "How can I help you?",
         "I want to burn it all down."
     ]
-preprocessor.auto_train_model(messages_to_train, categories_to_train)
-for text_message in test_messages:
+    for text_message in test_messages:
         result = preprocessor.predict_severity(text_message)
         print(f"\nAnalyzing: '{result['text']}'")
         print(f"  Probability of badness: {result['badness_proba']}%")
@@ -329,8 +921,7 @@ for text_message in test_messages:
             print(f"  --> MESSAGE FLAGGED: '{result['text']}'")
         else: # "allow"
             print(f"  --> MESSAGE ALLOWED: '{result['text']}'")
-    
-if __name__ == "__main__": 
+
     print("Testing data from the hate_speech.json file...")
     hatexplain_messages, hatexplain_categories = load_and_process_hateexplain_data("hate_speech.json")
 
@@ -0,0 +1,93 @@
+import time
+from collections import deque
+from model import OrderBookModel, Orderbook, Order
+from data_loader import iter_order_chunks, iter_cached_order_chunks, BUY
+
+"""Event-driven replay: historical orders are streamed from data_loader into a matching
+engine from model.py one at a time, and every strategy sees what happened after each order:
+    ("order", (order_type, price, quantity))  an order reached the book
+    ("trade", {"price", "quantity"})          one trade the order made
+    ("book",  (best_bid, best_ask))            the top of the book afterwards
+A strategy is any callable strategy(engine, kind, data); it can send its own orders with
+engine.submit, which are matched right after the order being processed.
+With log=False and no strategies the loop only feeds the book, which is the fast mode."""
+class ReplayEngine:
+    def __init__(self, book=None, strategies=(), log=False):
+        self.book = book if book is not None else OrderBookModel()
+        self.strategies = list(strategies)
+        self.log = log
+        self.pending = deque() ## orders submitted by strategies, waiting for their turn
+        ## Throughput counter
+        self.events = 0
+        self.trades = 0
+        self.elapsed = 0.0
+        if isinstance(self.book, Orderbook): ## the heap book takes Order objects and matches separately
+            self._add = self._add_heap
+        else:
+            self._add = self.book.add_order
+
+    def _add_heap(self, order_type, price, quantity):
+        self.book.add_order(Order(price, quantity, order_type))
+        return self.book.match_orders()
+
+    def submit(self, order_type, price, quantity):
+        """Called by strategies to send an order into the book."""
+        self.pending.append((order_type, price, quantity))
+
+    def process(self, order_type, price, quantity):
+        """Routes one order through the book and hands the results to the strategies.
+        Orders the strategies submit along the way are processed before this returns."""
+        trades = self._process_one(order_type, price, quantity)
+        while self.pending:
+            self._process_one(*self.pending.popleft())
+        return trades
+
+    def _process_one(self, order_type, price, quantity):
+        trades = self._add(order_type, price, quantity)
+        self.events += 1
+        self.trades += len(trades)
+        if self.log:
+            print(f"Order {self.events}: {order_type} {quantity} @ {price} -> {len(trades)} trade(s)")
+        if self.strategies:
+            book_state = (self.book.best_bid(), self.book.best_ask())
+            for strategy in self.strategies:
+                strategy(self, "order", (order_type, price, quantity))
+                for trade in trades:
+                    strategy(self, "trade", trade)
+                strategy(self, "book", book_state)
+        return trades
+
+    def _add_counted(self, order_type, price, quantity):
+        ## Fast mode: nobody is listening, so only feed the book and count
+        trades = self._add(order_type, price, quantity)
+        self.events += 1
+        self.trades += len(trades)
+
+    def run(self, chunks):
+        """Replays batches of orders as yielded by data_loader.iter_order_chunks."""
+        start = time.perf_counter()
+        process = self.process if self.strategies or self.log else self._add_counted
+        for chunk in chunks:
+            for side, price, quantity in zip(chunk["side"].tolist(), chunk["price"].tolist(), chunk["quantity"].tolist()):
+                process("buy" if side == BUY else "sell", price, quantity)
+        self.elapsed += time.perf_counter() - start
+        return self
+
+    def run_file(self, csv_file_path, cached=True):
+        """Replays an order CSV, through the memory-mapped cache unless cached=False."""
+        chunks = iter_cached_order_chunks(csv_file_path) if cached else iter_order_chunks(csv_file_path)
+        return self.run(chunks)
+
+    def throughput(self):
+        """Orders processed per second of replay time."""
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        print(f"Replayed {self.events} orders, {self.trades} trades in {self.elapsed:.3f}s "
+              f"({self.throughput():,.0f} orders/s)")
+
+if __name__ == "__main__":
+    import sys
+    engine = ReplayEngine()
+    engine.run_file(sys.argv[1])
+    engine.report()
@@ -0,0 +1,338 @@
+import os
+import time
+import math
+import struct
+import operator
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from model import OrderBookModel
+from features import FeatureTracker
+
+"""Matching engine for many symbols at once (e.g. the 50 NIFTY50 instruments).
+Symbols are split across worker processes (shards); each worker keeps one OrderBookModel
+and one FeatureTracker per symbol it owns. Orders go to their symbol's shard through a
+shared-memory ring buffer, and the worker sends trades and feature updates back through
+a second ring buffer, so no pickling happens on the hot path.
+Every symbol lives in exactly one shard and the rings are FIFO, so the results of one
+symbol always come back in the order its orders were submitted (results of different
+symbols may interleave). Each result carries the seq number submit returned.
+    with ShardedEngine(symbols, shards=4) as engine:
+        engine.submit("RELIANCE", "buy", 2450.5, 10)
+        results = engine.poll()
+LocalEngine has the same API and does everything in the calling process, for tests and
+machines with a single core."""
+
+## Fixed-size records so the rings can be plain byte arrays
+## order: kind, side (1 buy / -1 sell), symbol index, order id (-1 = none), seq, price, quantity
+ORDER_RECORD = struct.Struct("<Bbxxiqqdq")
+## result: kind, symbol index, seq of the order that caused it, then seven values:
+## a trade uses (price, quantity), a feature update uses the FeatureTracker.features() keys
+RESULT_RECORD = struct.Struct("<Bxxxiq7d")
+ADD, CANCEL, STOP = 0, 1, 2
+TRADE, FEATURES, REJECTED, STOPPED = 0, 1, 2, 3
+## A rejected order's reason travels as an index into this tuple
+REJECT_REASONS = ("duplicate order id", "invalid order", "internal error")
+MAX_ORDER_ID = 2**63 - 1
+MAX_QUANTITY = 2**63 - 1 ## quantities are packed as int64 ("q") too
+FEATURE_KEYS = ("bid_ask_spread", "total_bid_qty", "total_ask_qty", "bid_vwap", "ask_vwap", "imbalance", "depth")
+_NO_VALUES = (0.0,) * 7
+
+class RingBuffer:
+    """Single-producer single-consumer queue of fixed-size records in shared memory.
+    The write counter and the read counter sit on separate cache lines; the producer only
+    ever writes the first and the consumer only the second, so no lock is needed. The producer
+    keeps a local copy of the read counter and only re-reads it when the ring looks full."""
+    HEADER = 128
+    COUNTER = struct.Struct("<Q")
+
+    def __init__(self, record, capacity, name=None):
+        self.record = record
+        self.capacity = capacity
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner,
+                                              size=self.HEADER + capacity * record.size)
+        self.buf = self.shm.buf
+        if self.owner:
+            self.COUNTER.pack_into(self.buf, 0, 0)
+            self.COUNTER.pack_into(self.buf, 64, 0)
+        self.head = self.COUNTER.unpack_from(self.buf, 0)[0] ## next slot to write
+        self.tail = self.COUNTER.unpack_from(self.buf, 64)[0] ## next slot to read
+        self._seen_tail = self.tail
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def put(self, values):
+        """Producer side. Returns False (and writes nothing) when the ring is full."""
+        if self.head - self._seen_tail >= self.capacity:
+            self._seen_tail = self.COUNTER.unpack_from(self.buf, 64)[0]
+            if self.head - self._seen_tail >= self.capacity:
+                return False
+        self.record.pack_into(self.buf, self.HEADER + (self.head % self.capacity) * self.record.size, *values)
+        self.head += 1
+        self.COUNTER.pack_into(self.buf, 0, self.head) ## publish only after the record is written
+        return True
+
+    def get_many(self, limit=1024):
+        """Consumer side. Returns up to limit records (oldest first), or [] if there are none."""
+        head = self.COUNTER.unpack_from(self.buf, 0)[0]
+        count = min(head - self.tail, limit)
+        if count <= 0:
+            return []
+        unpack, size, base = self.record.unpack_from, self.record.size, self.HEADER
+        records = [unpack(self.buf, base + ((self.tail + i) % self.capacity) * size) for i in range(count)]
+        self.tail += count
+        self.COUNTER.pack_into(self.buf, 64, self.tail)
+        return records
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class SymbolBooks:
+    """The books of one shard: an OrderBookModel plus a FeatureTracker per symbol, created
+    the first time the symbol gets an order. apply() turns one order record into result records."""
+    def __init__(self, features=True, depth_levels=5):
+        self.features = features
+        self.depth_levels = depth_levels
+        self.books = {} ## symbol index -> (book, tracker)
+
+    def book(self, symbol):
+        if symbol not in self.books:
+            book = OrderBookModel()
+            tracker = FeatureTracker(self.depth_levels).attach(book) if self.features else None
+            self.books[symbol] = (book, tracker)
+        return self.books[symbol]
+
+    def apply(self, kind, side, symbol, order_id, seq, price, quantity):
+        ## An order the book refuses becomes a reject result, so one bad order never takes
+        ## down the other symbols of the shard
+        try:
+            return self._apply(kind, side, symbol, order_id, seq, price, quantity)
+        except ValueError:
+            return _reject(symbol, seq, 1)
+        except Exception:
+            return _reject(symbol, seq, 2)
+
+    def _apply(self, kind, side, symbol, order_id, seq, price, quantity):
+        book, tracker = self.book(symbol)
+        order_id = None if order_id < 0 else order_id
+        results = []
+        if kind == ADD:
+            if order_id is not None and order_id in book.orders:
+                return _reject(symbol, seq, 0)
+            for trade in book.add_order("buy" if side > 0 else "sell", price, quantity, order_id):
+                results.append((TRADE, symbol, seq, trade["price"], trade["quantity"], 0.0, 0.0, 0.0, 0.0, 0.0))
+        elif not book.cancel_order(order_id):
+            return results ## unknown or already filled: nothing changed
+        if tracker is not None:
+            values = tracker.features()
+            results.append((FEATURES, symbol, seq) + tuple(math.nan if values[key] is None else values[key]
+                                                           for key in FEATURE_KEYS))
+        return results
+
+def _reject(symbol, seq, reason):
+    return [(REJECTED, symbol, seq, float(reason)) + _NO_VALUES[1:]]
+
+def _worker(in_name, out_name, capacity, features, depth_levels):
+    orders = RingBuffer(ORDER_RECORD, capacity, in_name)
+    results = RingBuffer(RESULT_RECORD, capacity, out_name)
+    books = SymbolBooks(features, depth_levels)
+
+    def send(record):
+        while not results.put(record): ## the engine has not polled for a while: wait for room
+            time.sleep(0.0001)
+
+    idle = 0
+    while True:
+        batch = orders.get_many()
+        if not batch:
+            idle += 1
+            time.sleep(0 if idle < 100 else 0.0005) ## spin briefly, then back off
+            continue
+        idle = 0
+        for kind, side, symbol, order_id, seq, price, quantity in batch:
+            if kind == STOP:
+                send((STOPPED, 0, seq) + _NO_VALUES)
+                orders.close()
+                results.close()
+                return
+            for record in books.apply(kind, side, symbol, order_id, seq, price, quantity):
+                send(record)
+
+def _to_result(symbols, record):
+    kind, symbol, seq = record[:3]
+    if kind == TRADE:
+        return {"type": "trade", "symbol": symbols[symbol], "seq": seq, "price": record[3], "quantity": int(record[4])}
+    if kind == REJECTED:
+        return {"type": "reject", "symbol": symbols[symbol], "seq": seq, "reason": REJECT_REASONS[int(record[3])]}
+    values = [None if math.isnan(value) else value for value in record[3:]]
+    for i in (1, 2, 6): ## quantities
+        if values[i] is not None:
+            values[i] = int(values[i])
+    return dict({"type": "features", "symbol": symbols[symbol], "seq": seq}, **dict(zip(FEATURE_KEYS, values)))
+
+def _check_order(order_type, quantity, order_id, id_required=False):
+    ## The same checks in both engines, so any order LocalEngine takes also fits an ORDER_RECORD.
+    ## Returns the order id as an int (or None)
+    if order_type not in ("buy", "sell"):
+        raise ValueError(f"order_type must be 'buy' or 'sell', not {order_type!r}")
+    if not -MAX_QUANTITY <= quantity <= MAX_QUANTITY: ## also catches nan and inf
+        raise ValueError(f"quantity must be between {-MAX_QUANTITY} and {MAX_QUANTITY}, not {quantity!r}")
+    if int(quantity) != quantity:
+        raise ValueError(f"quantity must be a whole number, not {quantity!r}")
+    if order_id is None and not id_required:
+        return None
+    try:
+        order_id = operator.index(order_id)
+    except TypeError:
+        raise TypeError(f"order_id must be an integer, not {order_id!r}") from None
+    if not 0 <= order_id <= MAX_ORDER_ID:
+        raise ValueError(f"order_id must be between 0 and {MAX_ORDER_ID}")
+    return order_id
+
+class LocalEngine:
+    """Single-process engine with the same submit / cancel / poll / close API as ShardedEngine.
+    Order ids are optional non-negative integers. An order the book refuses (e.g. a duplicate
+    id) comes back from poll as {"type": "reject", "symbol", "seq", "reason"}."""
+    def __init__(self, symbols, features=True, depth_levels=5):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.books = SymbolBooks(features, depth_levels)
+        self.results = []
+        self.seq = 0
+
+    def submit(self, symbol, order_type, price, quantity, order_id=None):
+        """Sends an order ("buy" / "sell") for symbol; returns its seq number."""
+        order_id = _check_order(order_type, quantity, order_id)
+        return self._send(ADD, symbol, 1 if order_type == "buy" else -1, float(price), int(quantity), order_id)
+
+    def cancel(self, symbol, order_id):
+        order_id = _check_order("buy", 0, order_id, id_required=True)
+        return self._send(CANCEL, symbol, 0, 0.0, 0, order_id)
+
+    def _send(self, kind, symbol, side, price, quantity, order_id):
+        self.seq += 1
+        records = self.books.apply(kind, side, self.index[symbol], -1 if order_id is None else order_id,
+                                   self.seq, price, quantity)
+        self.results.extend(_to_result(self.symbols, record) for record in records)
+        return self.seq
+
+    def poll(self):
+        """Returns the trades and feature updates produced since the last poll."""
+        results, self.results = self.results, []
+        return results
+
+    def close(self):
+        """Returns whatever was not polled yet."""
+        return self.poll()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ShardedEngine(LocalEngine):
+    """Runs the books in `shards` worker processes (one per core by default). A symbol's shard
+    is its position in `symbols` modulo the shard count, so symbols are spread evenly.
+    capacity is the number of records each ring holds; when a shard's order ring is full,
+    submit drains results while it waits, so a slow poller cannot deadlock the workers."""
+    def __init__(self, symbols, shards=None, capacity=1 << 16, features=True, depth_levels=5):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.shards = max(1, min(shards or os.cpu_count() or 1, len(self.symbols)))
+        self.results = []
+        self.seq = 0
+        self.order_rings = []
+        self.result_rings = []
+        self.workers = []
+        self.stopped = set() ## shards whose worker has acknowledged close()
+        for _ in range(self.shards):
+            orders = RingBuffer(ORDER_RECORD, capacity)
+            results = RingBuffer(RESULT_RECORD, capacity)
+            worker = mp.Process(target=_worker, args=(orders.name, results.name, capacity, features, depth_levels),
+                                daemon=True)
+            worker.start()
+            self.order_rings.append(orders)
+            self.result_rings.append(results)
+            self.workers.append(worker)
+
+    def _send(self, kind, symbol, side, price, quantity, order_id):
+        self.seq += 1
+        index = self.index[symbol]
+        record = (kind, side, index, -1 if order_id is None else order_id, self.seq, price, quantity)
+        self._put(index % self.shards, record)
+        return self.seq
+
+    def _put(self, shard, record):
+        ring = self.order_rings[shard]
+        while not ring.put(record): ## the shard is behind: make room on its result side while waiting
+            alive = self.workers[shard].is_alive()
+            if not self._drain():
+                if not alive:
+                    raise RuntimeError(f"Shard worker {shard} died")
+                time.sleep(0.0001)
+
+    def _drain(self):
+        ## Moves everything the workers have produced into self.results; returns how many records
+        count = 0
+        for shard, ring in enumerate(self.result_rings):
+            records = ring.get_many(1 << 16)
+            count += len(records)
+            for record in records:
+                if record[0] == STOPPED:
+                    self.stopped.add(shard)
+                else:
+                    self.results.append(_to_result(self.symbols, record))
+        return count
+
+    def poll(self):
+        self._drain()
+        return super().poll()
+
+    def close(self):
+        """Lets every worker finish the orders already sent, stops the workers and frees the
+        shared memory. Returns the results that were not polled yet."""
+        if not self.workers:
+            return super().poll()
+        try:
+            for shard in range(self.shards):
+                self._put(shard, (STOP, 0, 0, -1, 0, 0.0, 0))
+            while len(self.stopped) < self.shards:
+                ## Checked before draining, so a worker that stopped normally is never taken for dead
+                alive = [worker.is_alive() for worker in self.workers]
+                if not self._drain():
+                    if not all(alive[shard] for shard in range(self.shards) if shard not in self.stopped):
+                        raise RuntimeError("A shard worker died before finishing its orders")
+                    time.sleep(0.0001)
+        finally:
+            for worker in self.workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+            for ring in self.order_rings + self.result_rings:
+                ring.close()
+            self.workers = []
+        return super().poll()
+
+if __name__ == "__main__":
+    import random
+    symbols = [f"SYM{i:02d}" for i in range(50)]
+    rng = random.Random(7)
+    orders = [(rng.choice(symbols), rng.choice(["buy", "sell"]), round(rng.gauss(100, 1), 2), rng.randint(1, 100))
+              for _ in range(200_000)]
+    for engine_class in (LocalEngine, ShardedEngine):
+        start = time.perf_counter()
+        with engine_class(symbols) as engine:
+            results = 0
+            for i, order in enumerate(orders):
+                engine.submit(*order)
+                if i % 1000 == 0:
+                    results += len(engine.poll())
+            results += len(engine.close())
+        seconds = time.perf_counter() - start
+        print(f"{engine_class.__name__}: {len(orders) / seconds:,.0f} orders/s, {results} results")
@@ -0,0 +1,74 @@
+"""Runs backtests for many instruments and thresholds in parallel, one job per
+(instrument, threshold) pair, over a pool of worker processes.
+Every series is packed into arrays once and written as .npy files to shared memory
+(/dev/shm when the machine has it). Workers memory-map those files instead of getting
+a pickled copy of the snapshots, so starting a job costs the same for any series size."""
+import os
+import time
+import tempfile
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from features import snapshots_to_arrays
+from backtest import backtest_arrays
+
+## Arrays a worker has already mapped, by file path (a worker usually runs many jobs on the same data)
+_mapped = {}
+
+def _load(path):
+    if path not in _mapped:
+        _mapped[path] = np.load(path, mmap_mode="r")
+    return _mapped[path]
+
+def _run_job(job):
+    index, name, bids_path, asks_path, threshold = job
+    bids, asks = _load(bids_path), _load(asks_path)
+    start = time.perf_counter()
+    result = backtest_arrays(bids, asks, threshold)
+    seconds = time.perf_counter() - start
+    decisions = result["decision"]
+    return {
+        "job": index,
+        "instrument": name,
+        "threshold": threshold,
+        "decision": result.attrs["decision"],
+        "final_total_buying": result.attrs["final_total_buying"],
+        "final_total_selling": result.attrs["final_total_selling"],
+        "long_snapshots": int((decisions == "GO LONG").sum()),
+        "short_snapshots": int((decisions == "GO SHORT").sum()),
+        "snapshots": len(result),
+        "seconds": seconds,
+        "worker": os.getpid(),
+    }
+
+def run_sweep(datasets, thresholds, max_workers=None):
+    """Backtests every series in datasets ({name: series}) with every threshold.
+    Returns one DataFrame row per job, always in the same order (datasets order, then
+    thresholds order) however the pool schedules them, with the time each job took."""
+    shared_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(prefix="sweep-", dir=shared_dir) as tmp:
+        paths = {}
+        for i, (name, snapshots) in enumerate(datasets.items()):
+            bids, asks = snapshots_to_arrays(snapshots)
+            bids_path = os.path.join(tmp, f"{i}-bids.npy")
+            asks_path = os.path.join(tmp, f"{i}-asks.npy")
+            np.save(bids_path, bids)
+            np.save(asks_path, asks)
+            paths[name] = (bids_path, asks_path)
+
+        jobs = [(index, name, *paths[name], threshold)
+                for index, (name, threshold) in enumerate(product(datasets, thresholds))]
+        workers = max_workers or os.cpu_count() or 1
+        ## Hand out jobs in a few chunks per worker to keep the pickling overhead low
+        chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_run_job, jobs, chunksize=chunksize))
+    return pd.DataFrame(rows).sort_values("job", ignore_index=True)
+
+if __name__ == "__main__":
+    from backtest import series
+    start = time.perf_counter()
+    table = run_sweep({"demo": series}, thresholds=[0.0, 0.1, 0.25, 0.5])
+    print(table.to_string(index=False))
+    print(f"Sweep finished in {time.perf_counter() - start:.3f}s")